@@ -1,33 +1,30 @@
-import sqlite3
 import streamlit as st
 import page1 as p1  # Ensure these files exist with corresponding page functions
 import page2 as p2
 import page3 as p3
+import page4 as p4
 from datetime import datetime, timedelta, time
 from pytz import timezone
+from db import get_read_connection, get_write_connection
+from schema import migrate
 
-# Database connection
-conn = sqlite3.connect('klse_tickers.db')
-c = conn.cursor()
-
-# Create user table if not exists
-def create_usertable():
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS userstable(
-        username TEXT PRIMARY KEY,
-        password TEXT
-    )''')
-    conn.commit()
+# Apply every pending schema migration once per process at startup
+# (schema.py owns the table definitions), so the login and signup handlers
+# never migrate
+@st.cache_resource(show_spinner=False)
+def ensure_schema():
+    migrate(get_write_connection())
 
 # Add user data
 def add_userdata(username, password):
-    c.execute('INSERT INTO userstable(username, password) VALUES (?, ?)', (username, password))
+    conn = get_write_connection()
+    conn.execute('INSERT INTO userstable(username, password) VALUES (?, ?)', (username, password))
     conn.commit()
 
 # Login validation
 def login_user(username, password):
-    c.execute('SELECT * FROM userstable WHERE username =? AND password = ?', (username, password))
-    return c.fetchall()
+    conn = get_read_connection()
+    return conn.execute('SELECT * FROM userstable WHERE username =? AND password = ?', (username, password)).fetchall()
 
 
 # Get market status
@@ -83,6 +80,7 @@ def main_dashboard():
         "Overview": p1.page1,
         "Sector Prediction": p2.page2,
         "Company Prediction": p3.page3,
+        "Stock Screener": p4.page4,
     }
 
     st.sidebar.subheader("Menu Navigation")
@@ -128,7 +126,6 @@ def login_page():
         username = st.text_input("Username")
         password = st.text_input("Password", type='password')
         if st.button("Login"):
-            create_usertable()
             if login_user(username, password):
                 st.session_state["logged_in"] = True
                 st.session_state["username"] = username
@@ -142,7 +139,6 @@ def login_page():
         confirm_password = st.text_input("Confirm Password", type='password')
         if st.button("Signup"):
             if new_password == confirm_password:
-                create_usertable()
                 add_userdata(new_user, new_password)
                 st.success("Account created successfully")
                 st.info("Go to Login to access the dashboard")
@@ -156,6 +152,7 @@ def logout():
 
 # Main app logic
 if __name__ == "__main__":
+    ensure_schema()
     if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
         login_page()
     else:
@@ -0,0 +1,199 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from history import read_history
+from forecasting import FORECAST_HORIZONS, FORECASTERS, MAX_HORIZON, create_features, get_forecaster, purged_train_end
+
+# Walk-forward backtesting of the forecasting models. Each ticker's last
+# folds * test_days forecastable days are split into consecutive test
+# windows; a fold trains on every earlier day whose targets were already
+# known when its window starts, then forecasts the window. Folds run in
+# parallel on a process pool. The feature and target matrices of every
+# ticker are packed once into shared memory, so tasks only send offsets.
+# Each fold records the MAE at every horizon next to a naive "last close"
+# forecast, and the wall time of fit, predict and (for incremental models)
+# absorbing the window with update().
+
+DEFAULT_FOLDS = 5
+DEFAULT_TEST_DAYS = 21
+DEFAULT_MIN_TRAIN_DAYS = 60
+
+_shared = {}
+
+# Pack every ticker's (X, Y) into two shared-memory blocks. Returns the
+# blocks and {ticker: (first row, row count, dates)}.
+def pack_features(frames):
+    rows = sum(len(X) for X, _ in frames.values())
+    feature_names = next(iter(frames.values()))[0].columns
+    x_block = shared_memory.SharedMemory(create=True, size=max(rows * len(feature_names) * 8, 1))
+    y_block = shared_memory.SharedMemory(create=True, size=max(rows * MAX_HORIZON * 8, 1))
+    X_all = np.ndarray((rows, len(feature_names)), dtype=float, buffer=x_block.buf)
+    Y_all = np.ndarray((rows, MAX_HORIZON), dtype=float, buffer=y_block.buf)
+
+    layout = {}
+    start = 0
+    for ticker, (X, Y) in frames.items():
+        X_all[start:start + len(X)] = X.to_numpy(dtype=float)
+        Y_all[start:start + len(X)] = Y.to_numpy(dtype=float)
+        layout[ticker] = (start, len(X), X.index)
+        start += len(X)
+    return x_block, y_block, list(feature_names), layout
+
+# Pool initializer: map the shared blocks without copying them
+def _attach(x_name, y_name, rows, feature_names):
+    _shared['blocks'] = [shared_memory.SharedMemory(name=x_name), shared_memory.SharedMemory(name=y_name)]
+    _shared['X'] = np.ndarray((rows, len(feature_names)), dtype=float, buffer=_shared['blocks'][0].buf)
+    _shared['Y'] = np.ndarray((rows, MAX_HORIZON), dtype=float, buffer=_shared['blocks'][1].buf)
+    _shared['columns'] = feature_names
+
+# Fold windows of one ticker's targets Y as (first training row, end of
+# training rows, first test row, end of test rows). Training rows are purged
+# before each window (purged_train_end) so no training target overlaps it.
+def walk_forward_folds(Y, folds=DEFAULT_FOLDS, test_days=DEFAULT_TEST_DAYS, min_train_days=DEFAULT_MIN_TRAIN_DAYS):
+    known = np.flatnonzero(~np.isnan(Y).any(axis=1))
+    forecastable = int(known[-1]) + 1 if len(known) else 0
+    windows = []
+    for fold in range(folds):
+        test_end = forecastable - (folds - 1 - fold) * test_days
+        test_start = test_end - test_days
+        train_end = purged_train_end(test_start)
+        if test_start < 0 or train_end < min_train_days:
+            continue
+        windows.append((0, train_end, test_start, test_end))
+    return windows
+
+# MAE of price forecasts over the first `horizon` days
+def _mae(y_true, y_pred, horizon):
+    return float(np.abs(y_true[:, :horizon] - y_pred[:, :horizon]).mean())
+
+# Run one fold inside a pool worker
+def run_fold(model, settings, ticker, start, fold, window):
+    train_start, train_end, test_start, test_end = window
+    X = pd.DataFrame(_shared['X'][start:start + test_end], columns=_shared['columns'], copy=False)
+    Y = _shared['Y'][start:start + test_end]
+    forecaster = get_forecaster(model, **settings)
+    train = np.arange(train_start, train_end)[~np.isnan(Y[train_start:train_end]).any(axis=1)]
+
+    fit_start = time.perf_counter()
+    forecaster.fit(X.iloc[train], Y[train])
+    fit_seconds = time.perf_counter() - fit_start
+
+    X_test = X.iloc[test_start:test_end]
+    predict_start = time.perf_counter()
+    predicted_returns = forecaster.predict(X_test)
+    predict_seconds = time.perf_counter() - predict_start
+
+    update_seconds = np.nan
+    if forecaster.incremental:
+        update_start = time.perf_counter()
+        forecaster.update(X_test, Y[test_start:test_end])
+        update_seconds = time.perf_counter() - update_start
+
+    closes = X_test['close'].to_numpy()[:, None]
+    y_true = closes * (1 + Y[test_start:test_end])
+    y_pred = closes * (1 + np.asarray(predicted_returns))
+    result = {'model': model, 'ticker': ticker, 'fold': fold, 'train_days': len(train),
+              'test_days': test_end - test_start, 'fit_seconds': fit_seconds, 'predict_seconds': predict_seconds,
+              'update_seconds': update_seconds}
+    for horizon in FORECAST_HORIZONS:
+        result[f'mae_{horizon}d'] = _mae(y_true, y_pred, horizon)
+        result[f'naive_mae_{horizon}d'] = _mae(y_true, np.broadcast_to(closes, y_true.shape), horizon)
+    return result, test_start
+
+# Backtest the given models over the given tickers. `settings` are
+# get_forecaster arguments shared by every model. Returns one row per
+# (model, ticker, fold).
+def run_backtest(conn, tickers, models, folds=DEFAULT_FOLDS, test_days=DEFAULT_TEST_DAYS,
+                 min_train_days=DEFAULT_MIN_TRAIN_DAYS, workers=None, settings=None):
+    settings = {'n_jobs': 1, **(settings or {})}
+    frames = {}
+    for ticker in tickers:
+        data = read_history(conn, ticker)
+        if not data.empty:
+            frames[ticker] = create_features(data)
+    if not frames:
+        return pd.DataFrame()
+
+    x_block, y_block, feature_names, layout = pack_features(frames)
+    tasks = [(model, ticker, start, fold, window)
+             for ticker, (start, count, _) in layout.items()
+             for fold, window in enumerate(walk_forward_folds(frames[ticker][1].to_numpy(), folds, test_days,
+                                                              min_train_days))
+             for model in models]
+    results = []
+    try:
+        rows = sum(count for _, count, _ in layout.values())
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_attach,
+                                 initargs=(x_block.name, y_block.name, rows, feature_names)) as executor, \
+                tqdm(total=len(tasks), desc="Backtesting", unit="fold") as pbar:
+            futures = {executor.submit(run_fold, model, settings, ticker, start, fold, window): (model, ticker)
+                       for model, ticker, start, fold, window in tasks}
+            for future in as_completed(futures):
+                model, ticker = futures[future]
+                try:
+                    result, test_start = future.result()
+                    result['test_start'] = layout[ticker][2][test_start]
+                    results.append(result)
+                except Exception as e:
+                    print(f"Error occurred while backtesting {model} on {ticker}: {e}")
+                finally:
+                    pbar.update(1)
+    finally:
+        for block in (x_block, y_block):
+            block.close()
+            block.unlink()
+    if not results:
+        return pd.DataFrame()
+    return pd.DataFrame(results).sort_values(['model', 'ticker', 'fold'], ignore_index=True)
+
+# Per-model accuracy and cost: mean MAE at every horizon, the skill against
+# the naive forecast at the longest horizon (positive is better than naive)
+# and mean wall times per fold
+def summarize(results):
+    columns = ([f'mae_{horizon}d' for horizon in FORECAST_HORIZONS]
+               + [f'naive_mae_{horizon}d' for horizon in FORECAST_HORIZONS]
+               + ['fit_seconds', 'predict_seconds', 'update_seconds'])
+    summary = results.groupby('model')[columns].mean()
+    summary.insert(0, 'folds', results.groupby('model').size())
+    summary.insert(1, 'tickers', results.groupby('model')['ticker'].nunique())
+    summary[f'skill_{MAX_HORIZON}d'] = 1 - summary[f'mae_{MAX_HORIZON}d'] / summary[f'naive_mae_{MAX_HORIZON}d']
+    return summary
+
+# Command-line entry point
+if __name__ == "__main__":
+    from db import open_read_connection
+
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the forecasting models.")
+    parser.add_argument('--models', nargs='+', choices=list(FORECASTERS), default=list(FORECASTERS))
+    parser.add_argument('--tickers', nargs='+', help="Tickers to backtest (default: every ticker with prices)")
+    parser.add_argument('--limit', type=int, default=None, help="Only backtest the first N tickers")
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS)
+    parser.add_argument('--test-days', type=int, default=DEFAULT_TEST_DAYS, help="Trading days per test window")
+    parser.add_argument('--min-train-days', type=int, default=DEFAULT_MIN_TRAIN_DAYS)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--trees', type=int, default=None, help="Trees per model for tree ensembles")
+    parser.add_argument('--output', help="Write the per-fold results to this CSV file")
+    args = parser.parse_args()
+
+    conn = open_read_connection()
+    try:
+        tickers = args.tickers or [row[0] for row in conn.execute("SELECT ticker FROM latest_snapshot ORDER BY ticker")]
+        tickers = tickers[:args.limit] if args.limit else tickers
+        results = run_backtest(conn, tickers, args.models, folds=args.folds, test_days=args.test_days,
+                               min_train_days=args.min_train_days, workers=args.workers,
+                               settings={'n_estimators': args.trees})
+    finally:
+        conn.close()
+
+    if results.empty:
+        print("No folds could be run.")
+    else:
+        if args.output:
+            results.to_csv(args.output, index=False)
+            print(f"Wrote {len(results)} fold results to {args.output}")
+        print(summarize(results).to_string(float_format=lambda value: f"{value:.4f}"))
@@ -0,0 +1,113 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from generation import get_price_version
+
+# pyarrow is optional: without it the mirror is simply never written or read
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Columnar mirror of stock_prices: one uncompressed Arrow IPC file per ticker.
+# Uncompressed IPC files can be memory-mapped and read without decoding, so a
+# history load costs roughly a page-in of the file instead of materializing
+# every row through sqlite3. Each file records the ticker's price version it
+# was exported at, and is only read while that is still the current version.
+COLUMNAR_DIR = 'price_columns'
+PRICE_FIELDS = ['open', 'close', 'high', 'low', 'volume']
+VERSION_KEY = b'data_version'
+
+def is_available():
+    return pa is not None
+
+def ticker_path(ticker, directory=COLUMNAR_DIR):
+    return os.path.join(directory, f"{ticker}.arrow")
+
+# Rewrite the mirror files of the given tickers from SQLite. Each file is
+# written to a temporary name and renamed, so readers never see a partial file.
+# Returns the number of files written; tickers without prices are skipped.
+def export_tickers(conn, tickers, directory=COLUMNAR_DIR):
+    if pa is None:
+        return 0
+    os.makedirs(directory, exist_ok=True)
+
+    exported = 0
+    for ticker in tickers:
+        # Read the version first: if a write lands in between, the file is
+        # stamped older than its rows and is merely re-read from SQLite
+        data_version = get_price_version(conn, ticker)
+        rows = conn.execute("SELECT date, open, close, high, low, volume FROM stock_prices "
+                            "WHERE ticker = ? ORDER BY date", (ticker,)).fetchall()
+        if not rows:
+            continue
+        dates, *columns = zip(*rows)
+        table = pa.table({
+            'date': pa.array(np.array(dates, dtype='datetime64[D]'), type=pa.date32()),
+            **{name: pa.array(np.array(values, dtype=float)) for name, values in zip(PRICE_FIELDS, columns)},
+        }).replace_schema_metadata({VERSION_KEY: str(data_version).encode()})
+
+        path = ticker_path(ticker, directory)
+        temporary_path = f"{path}.tmp"
+        with pa.OSFile(temporary_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temporary_path, path)
+        exported += 1
+    return exported
+
+# Export every ticker in stock_prices
+def export_all(conn, directory=COLUMNAR_DIR):
+    tickers = [row[0] for row in conn.execute("SELECT ticker FROM latest_snapshot")]
+    return export_tickers(conn, tickers, directory)
+
+# Memory-map one ticker's mirror file and return its Arrow table, or None if
+# there is no mirror. The table keeps the mapping alive for as long as it is used.
+def read_ticker_table(ticker, directory=COLUMNAR_DIR):
+    if pa is None:
+        return None
+    path = ticker_path(ticker, directory)
+    if not os.path.exists(path):
+        return None
+    source = pa.memory_map(path, 'r')
+    return pa.ipc.open_file(source).read_all()
+
+# The price version a mirror table was exported at, or None if it has none
+def table_version(table):
+    stamp = (table.schema.metadata or {}).get(VERSION_KEY)
+    return int(stamp) if stamp is not None else None
+
+# Read one ticker's history from the mirror in the same shape as
+# "SELECT * FROM stock_prices WHERE ticker = ?", or None if the mirror is
+# missing or was not exported at `data_version` (the ticker's current price
+# version in SQLite).
+def read_ticker_history(ticker, data_version, columns=None, directory=COLUMNAR_DIR):
+    table = read_ticker_table(ticker, directory)
+    if table is None or table.num_rows == 0 or table_version(table) != data_version:
+        return None
+
+    dates = table.column('date').to_numpy().astype('datetime64[ns]')
+
+    columns = PRICE_FIELDS if columns is None else [column for column in columns if column in PRICE_FIELDS]
+    data = {'ticker': ticker, 'date': dates}
+    for column in columns:
+        data[column] = table.column(column).to_numpy()
+    return pd.DataFrame(data)
+
+# Command-line entry point: rebuild the whole mirror from SQLite
+if __name__ == "__main__":
+    from db import open_write_connection
+
+    parser = argparse.ArgumentParser(description="Rebuild the columnar (Arrow IPC) mirror of stock_prices.")
+    parser.add_argument('--dir', default=COLUMNAR_DIR, help="Directory for the per-ticker Arrow files")
+    args = parser.parse_args()
+
+    if not is_available():
+        raise SystemExit("pyarrow is not installed; the columnar mirror is unavailable.")
+    conn = open_write_connection()
+    try:
+        print(f"Exported {export_all(conn, args.dir)} tickers to {args.dir}")
+    finally:
+        conn.close()
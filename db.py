@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+import pandas as pd
+
+# Path to the SQLite database shared by the loaders and the dashboard
+DB_PATH = 'klse_tickers.db'
+
+# Pragmas applied to every dashboard read connection: memory-map the file,
+# keep a larger page cache and sort/group in memory
+READ_PRAGMAS = (
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    "PRAGMA cache_size=-32768",    # 32 MiB
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Pragmas applied to write connections. WAL lets readers keep reading while
+# a loader or a signup commits; busy_timeout waits out short write locks.
+WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+)
+
+def _apply(conn, pragmas):
+    for pragma in pragmas:
+        conn.execute(pragma)
+    return conn
+
+# Open a read-only connection through a URI so the dashboard can never write
+def open_read_connection(path=DB_PATH):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    return _apply(conn, READ_PRAGMAS)
+
+# Open a read-write connection in WAL mode (loaders, user table)
+def open_write_connection(path=DB_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    return _apply(conn, WRITE_PRAGMAS)
+
+
+# One connection per thread, reused across calls. Streamlit runs each script
+# run on its own thread, so connections owned by threads that have finished
+# are handed to the next thread instead of being reopened.
+class ConnectionPool:
+    def __init__(self, factory):
+        self.factory = factory
+        self.by_thread = {}
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        thread = threading.current_thread()
+        with self.lock:
+            conn = self.by_thread.get(thread)
+            if conn is not None:
+                return conn
+            for owner in [owner for owner in self.by_thread if not owner.is_alive()]:
+                self.idle.append(self.by_thread.pop(owner))
+            conn = self.idle.pop() if self.idle else None
+
+        if conn is None:
+            conn = self.factory()
+        with self.lock:
+            self.by_thread[thread] = conn
+        return conn
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.by_thread.values()) + self.idle
+            self.by_thread.clear()
+            self.idle.clear()
+        for conn in connections:
+            conn.close()
+
+
+_read_pool = ConnectionPool(open_read_connection)
+_write_pool = ConnectionPool(open_write_connection)
+
+# Pooled read-only connection for the calling thread
+def get_read_connection():
+    return _read_pool.get()
+
+# Pooled read-write connection for the calling thread
+def get_write_connection():
+    return _write_pool.get()
+
+# Run a read query on the pooled connection and return a DataFrame
+def read_sql(query, params=()):
+    return pd.read_sql(query, get_read_connection(), params=params)
+
+# Close every pooled connection (tests, or before replacing the database file)
+def close_all():
+    _read_pool.close_all()
+    _write_pool.close_all()
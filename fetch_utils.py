@@ -0,0 +1,67 @@
+import random
+import threading
+import time
+
+# Token-bucket rate limiter shared by all fetch workers. Tokens refill at
+# `rate` per second up to `burst`; acquire() blocks until a token is free.
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Run fn() on a daemon thread and give up after `timeout` seconds. A call
+# that hangs is abandoned rather than blocking the worker that made it.
+def call_with_timeout(fn, timeout):
+    if timeout is None:
+        return fn()
+
+    result = {}
+
+    def target():
+        try:
+            result['value'] = fn()
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"call did not finish within {timeout}s")
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+# Exponential backoff with full jitter: a random delay in [0, base * 2**attempt]
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+# Call fn() with rate limiting, a per-attempt timeout and jittered retries.
+# Returns (value, attempts); the last error is re-raised once retries run out.
+def fetch_with_retries(fn, limiter=None, retries=3, timeout=30, base_delay=1.0, max_delay=30.0):
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return call_with_timeout(fn, timeout), attempt + 1
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from tqdm import tqdm
+from db import DB_PATH, open_read_connection
+from generation import get_price_version
+from history import read_history
+from forecasting import (FEATURE_VERSION, FORECAST_HORIZONS, FORECASTERS, DEFAULT_FORECASTER, create_features,
+                         fit_forecaster, forecast_horizons, get_forecaster, horizon_scores)
+from ingest_journal import finish_run, record_failure, record_success, start_run
+
+# Nightly batch job: train (or load from the model registry) every ticker's
+# forecast model on a process pool and store the forecasts of every horizon,
+# with the model's MAE and R^2, in the forecasts table. Rows are tagged with
+# the price version of the ticker they were computed from, so the Company
+# Prediction page uses them only while that ticker's prices are unchanged and
+# trains on demand otherwise; writes to other tickers or other tables leave
+# them current. Writing forecasts does not bump the generation.
+JOB_NAME = 'forecasts'
+
+# Seconds one ticker may spend loading, training and predicting
+DEFAULT_TIMEOUT = 120
+
+WRITE_BATCH_SIZE = 50
+
+_worker_conn = None
+
+# Pool initializer: one read-only connection per worker process
+def _init_worker(db_path):
+    global _worker_conn
+    _worker_conn = open_read_connection(db_path)
+
+class ForecastTimeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise ForecastTimeout()
+
+# Forecast one ticker inside a pool worker with the forecaster built from
+# `settings` (get_forecaster arguments). The timeout is enforced with SIGALRM
+# where the platform has it; training checks for it between trees.
+# Returns (ticker, forecast rows).
+def forecast_ticker(ticker, timeout=DEFAULT_TIMEOUT, settings=None):
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        data_version = get_price_version(_worker_conn, ticker)
+        data = read_history(_worker_conn, ticker)
+        if data.empty:
+            raise ValueError("no price history")
+        forecaster = get_forecaster(**(settings or {}))
+        X, Y = create_features(data, ticker)
+        fitted = fit_forecaster(X, Y, ticker, data_version, forecaster)
+        created_at = pd.Timestamp.now().isoformat(timespec='seconds')
+        rows = []
+        for horizon, predictions in forecast_horizons(fitted, X).items():
+            mae, r_squared = horizon_scores(fitted, horizon)
+            rows.append((ticker, horizon, data_version, FEATURE_VERSION, json.dumps(predictions.tolist()),
+                         float(mae), float(r_squared), created_at, forecaster.name))
+        return ticker, rows
+    except ForecastTimeout:
+        raise TimeoutError(f"forecast did not finish within {timeout}s") from None
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+# Replace the stored forecasts of the given rows' (ticker, model) pairs,
+# leaving other models' forecasts of the same tickers in place. Does not commit.
+def store_forecasts(conn, rows):
+    conn.executemany("DELETE FROM forecasts WHERE ticker = ? AND model = ?", {(row[0], row[8]) for row in rows})
+    conn.executemany('''INSERT INTO forecasts
+                        (ticker, horizon, data_version, feature_version, predictions, mae, r_squared, created_at, model)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+# Look up a ticker's precomputed forecast for a horizon. Returns
+# (predictions, mae, r_squared, created_at), or None if there is none for the
+# given price version of the ticker, the current feature set and the given
+# model.
+def get_forecast(conn, ticker, horizon, data_version, model=DEFAULT_FORECASTER):
+    row = conn.execute('''SELECT predictions, mae, r_squared, created_at FROM forecasts
+                          WHERE ticker = ? AND horizon = ? AND data_version = ? AND feature_version = ? AND model = ?''',
+                       (ticker, horizon, data_version, FEATURE_VERSION, model)).fetchone()
+    if row is None:
+        return None
+    predictions, mae, r_squared, created_at = row
+    return json.loads(predictions), mae, r_squared, created_at
+
+# Tickers with prices whose forecasts from `model` are missing or older than
+# the ticker's current price version
+def stale_tickers(conn, model=DEFAULT_FORECASTER):
+    rows = conn.execute('''SELECT ticker FROM latest_snapshot WHERE ticker NOT IN (
+                               SELECT f.ticker FROM forecasts f
+                               JOIN price_versions v ON v.ticker = f.ticker AND v.data_version = f.data_version
+                               WHERE f.feature_version = ? AND f.model = ?
+                               GROUP BY f.ticker HAVING COUNT(*) = ?)
+                           ORDER BY ticker''',
+                        (FEATURE_VERSION, model, len(FORECAST_HORIZONS))).fetchall()
+    return [row[0] for row in rows]
+
+# Forecast every stale ticker (or the given tickers) on a process pool and
+# store the results in batches. `settings` are get_forecaster arguments; each
+# model runs single-threaded by default since the pool already uses every
+# core. Returns (tickers forecast, failed tickers).
+def run_forecasts(conn, tickers=None, workers=None, timeout=DEFAULT_TIMEOUT, settings=None,
+                  write_batch_size=WRITE_BATCH_SIZE, db_path=DB_PATH):
+    settings = {'n_jobs': 1, **(settings or {})}
+    if tickers is None:
+        tickers = stale_tickers(conn, get_forecaster(**settings).name)
+    if not tickers:
+        print("All forecasts are up to date.")
+        return 0, []
+
+    run_id = start_run(conn, JOB_NAME, tickers)
+    pending_rows = []
+    forecast = 0
+    failed = []
+    start_time = time.perf_counter()
+
+    def write(batch):
+        with conn:
+            for ticker, rows in batch:
+                record_success(conn, run_id, ticker, len(rows))
+                store_forecasts(conn, rows)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(db_path,)) as executor, \
+            tqdm(total=len(tickers), desc="Forecasting", unit="ticker") as pbar:
+        futures = {executor.submit(forecast_ticker, ticker, timeout, settings): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                pending_rows.append(future.result())
+                forecast += 1
+            except Exception as e:
+                failed.append(ticker)
+                record_failure(conn, run_id, ticker, e)
+                print(f"Error occurred while forecasting {ticker}: {e}")
+            finally:
+                pbar.update(1)
+
+            if len(pending_rows) >= write_batch_size:
+                write(pending_rows)
+                pending_rows = []
+
+    write(pending_rows)
+    finish_run(conn, run_id)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Forecast {forecast} of {len(tickers)} tickers in {elapsed:.1f}s")
+    return forecast, failed
+
+# Command-line entry point, meant to run nightly after the loaders
+if __name__ == "__main__":
+    from db import open_write_connection
+
+    parser = argparse.ArgumentParser(description="Precompute forecasts for every ticker into the forecasts table.")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="Seconds allowed per ticker")
+    parser.add_argument('--model', choices=list(FORECASTERS), default=None,
+                        help="Forecasting model (default: FORECAST_MODEL or random_forest)")
+    parser.add_argument('--trees', type=int, default=None, help="Trees per model for tree ensembles")
+    parser.add_argument('--n-jobs', type=int, default=1, help="Threads per model")
+    parser.add_argument('--all', action='store_true', help="Recompute every ticker, not only stale ones")
+    parser.add_argument('--tickers', nargs='+', help="Only forecast these tickers")
+    args = parser.parse_args()
+
+    conn = open_write_connection()
+    try:
+        tickers = args.tickers
+        if tickers is None and args.all:
+            tickers = [row[0] for row in conn.execute("SELECT ticker FROM latest_snapshot ORDER BY ticker")]
+        settings = {'name': args.model, 'n_estimators': args.trees, 'n_jobs': args.n_jobs}
+        forecast, failed = run_forecasts(conn, tickers, workers=args.workers, timeout=args.timeout, settings=settings)
+        if failed:
+            print(f"{len(failed)} tickers failed. Please check the logs.")
+    finally:
+        conn.close()
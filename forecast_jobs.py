@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from history import load_history
+from forecasting import FEATURE_VERSION, forecast_all_horizons
+
+# Background job queue for on-demand forecasts. The queue is shared by every
+# Streamlit session in the process: a page submits a job, keeps its id in the
+# session and polls it while it renders, so no script run ever waits for a
+# model to train. Identical requests (same ticker, price version, feature
+# set and model) share one job, whether still running or recently finished.
+JOB_WORKERS = 2
+
+# Finished jobs kept for polling and reuse
+FINISHED_JOBS_KEPT = 256
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = "Waiting for a worker"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    # Called by the job function to publish its progress (0 to 1)
+    def report(self, progress, message):
+        self.progress = progress
+        self.message = message
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, keep=FINISHED_JOBS_KEPT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='forecast-job')
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self.by_key = {}
+        self.lock = threading.Lock()
+
+    # Run fn(job.report, *args) in the background and return its job. A job
+    # already queued, running or finished for the same key is returned
+    # instead; a failed one only while retry is False.
+    def submit(self, key, fn, *args, retry=False):
+        with self.lock:
+            job = self.jobs.get(self.by_key.get(key))
+            if job is not None and not (retry and job.status == 'failed'):
+                return job
+            job = Job(key)
+            self.jobs[job.id] = job
+            self.by_key[key] = job.id
+            self._trim()
+        self.executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.status = 'running'
+        try:
+            job.result = fn(job.report, *args)
+            job.report(1.0, "Done")
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    # Drop the oldest finished jobs beyond the number kept
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            job = self.jobs.pop(job_id)
+            if self.by_key.get(job.key) == job_id:
+                del self.by_key[job.key]
+
+    # The job with this id, or None if it is unknown or no longer kept
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+# The process-wide job queue shared by every Streamlit session
+def get_job_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+def _forecast_job(report, ticker, data_version, forecaster):
+    report(0.05, "Loading price history")
+    data = load_history(ticker)
+    if data.empty:
+        raise ValueError(f"No historical data found for ticker {ticker}.")
+    return forecast_all_horizons(data, ticker, data_version, forecaster, report=report)
+
+# Submit a background forecast of every horizon for a ticker. The job's
+# result is {horizon: (forecast prices, MAE, R^2)}. With retry, a failed
+# job for the same request is run again.
+def submit_forecast(ticker, data_version, forecaster, retry=False):
+    key = ('forecast', ticker, data_version, FEATURE_VERSION, tuple(sorted(forecaster.registry_params().items())))
+    return get_job_queue().submit(key, _forecast_job, ticker, data_version, forecaster, retry=retry)
@@ -0,0 +1,382 @@
+import copy
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import mean_absolute_error, r2_score
+from model_registry import get_model_registry
+
+# Price forecasting shared by the Company Prediction page (page3.py) and the
+# nightly batch job (forecast_batch.py). Kept free of Streamlit so that pool
+# workers can import it.
+
+# Forecast horizons offered on the page, in trading days (1, 2 and 3 weeks
+# and 1 month)
+FORECAST_HORIZONS = (5, 10, 15, 21)
+
+# Models are direct multi-horizon: from one day's features they predict the
+# return to each of the next MAX_HORIZON closes at once, so every horizon
+# comes out of a single predict call.
+MAX_HORIZON = max(FORECAST_HORIZONS)
+
+# Version of the features and targets built by create_features and of the
+# way models are trained and scored on them. Bump it whenever either changes
+# so stored models and forecasts are never reused.
+FEATURE_VERSION = 4
+
+# Features are computed per trading day (one row per stored price, no
+# calendar-day filling): the day's prices and volume, the previous closes,
+# rolling means of the closes up to and including the day, and returns over
+# the previous closes.
+PRICE_FEATURES = ('open', 'close', 'high', 'low', 'volume')
+LAG_DAYS = 5
+ROLLING_WINDOWS = (5,)
+RETURN_PERIODS = (1, 5)
+
+# Closes before a day needed to complete its features
+FEATURE_HISTORY = max(LAG_DAYS, max(ROLLING_WINDOWS) - 1, max(RETURN_PERIODS) + 1)
+
+CLOSE_FEATURES = ([f'lag_{lag}' for lag in range(1, LAG_DAYS + 1)]
+                  + [f'rolling_mean_{window}' for window in ROLLING_WINDOWS]
+                  + [f'return_{period}' for period in RETURN_PERIODS])
+
+# Close-derived features of `closes`, given up to FEATURE_HISTORY earlier
+# closes as context. One strided window view covers every lag, rolling mean
+# and return; days without enough history get NaN.
+def _close_features(closes, context):
+    if len(closes) == 0:
+        return np.empty((0, len(CLOSE_FEATURES)))
+    padded = np.concatenate([np.full(FEATURE_HISTORY - len(context), np.nan), context, closes])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, FEATURE_HISTORY + 1)
+    today = FEATURE_HISTORY
+    columns = [windows[:, today - lag] for lag in range(1, LAG_DAYS + 1)]
+    columns += [windows[:, today - window + 1:].mean(axis=1) for window in ROLLING_WINDOWS]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns += [windows[:, today - 1] / windows[:, today - 1 - period] - 1 for period in RETURN_PERIODS]
+    return np.column_stack(columns)
+
+# Feature matrix of one ticker's trading days. New days can be appended
+# without recomputing the existing rows; extend() returns a new object, so a
+# cached instance is never modified while another thread reads it.
+class TradingDayFeatures:
+    def __init__(self, price_columns, dates=None, closes=None, prices=None, matrix=None):
+        self.price_columns = tuple(price_columns)
+        self.feature_names = list(self.price_columns) + CLOSE_FEATURES
+        self.dates = np.array([], dtype='datetime64[ns]') if dates is None else dates
+        self.closes = np.array([], dtype=float) if closes is None else closes
+        self.prices = np.empty((0, len(self.price_columns))) if prices is None else prices
+        self.matrix = np.empty((0, len(self.feature_names))) if matrix is None else matrix
+
+    def __len__(self):
+        return len(self.dates)
+
+    # A new TradingDayFeatures with the rows of `data` (sorted, all after the
+    # last stored day) appended
+    def extend(self, data):
+        dates = pd.to_datetime(data['date'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+        keep = ~np.isnat(dates)
+        closes = data['close'].to_numpy(dtype=float)[keep]
+        prices = data[list(self.price_columns)].to_numpy(dtype=float)[keep]
+        block = np.hstack([prices, _close_features(closes, self.closes[-FEATURE_HISTORY:])])
+        return TradingDayFeatures(self.price_columns, np.concatenate([self.dates, dates[keep]]),
+                                  np.concatenate([self.closes, closes]), np.vstack([self.prices, prices]),
+                                  np.vstack([self.matrix, block]))
+
+    # True if `data` starts with exactly the days and prices stored here
+    def is_prefix_of(self, data):
+        columns = tuple(column for column in PRICE_FEATURES if column in data.columns)
+        if len(data) < len(self) or columns != self.price_columns:
+            return False
+        count = len(self)
+        if not np.array_equal(data['close'].to_numpy(dtype=float)[:count], self.closes, equal_nan=True):
+            return False
+        if not all(np.array_equal(data[column].to_numpy(dtype=float)[:count], self.prices[:, index], equal_nan=True)
+                   for index, column in enumerate(self.price_columns)):
+            return False
+        dates = data['date'].to_numpy()[:count]
+        if dates.dtype != self.dates.dtype:
+            dates = pd.to_datetime(dates, errors='coerce').to_numpy(dtype='datetime64[ns]')
+        return np.array_equal(dates, self.dates)
+
+    # Feature matrix X over the days with complete features, and targets Y:
+    # the return from each day's close to the close 1..horizon trading days
+    # later (NaN where those days are not known yet)
+    def frames(self, horizon=MAX_HORIZON):
+        complete = ~np.isnan(self.matrix).any(axis=1) & ~np.isnan(self.closes)
+        index = pd.DatetimeIndex(self.dates[complete], name='date')
+        X = pd.DataFrame(self.matrix[complete], index=index, columns=self.feature_names)
+        future = np.lib.stride_tricks.sliding_window_view(
+            np.concatenate([self.closes, np.full(horizon, np.nan)]), horizon + 1)[:len(self.closes)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            targets = future[:, 1:] / future[:, :1] - 1
+        Y = pd.DataFrame(targets[complete], index=index, columns=[f'return_{day}d' for day in range(1, horizon + 1)])
+        return X, Y
+
+# Build the features of a price history frame from scratch
+def build_features(data):
+    return TradingDayFeatures([column for column in PRICE_FEATURES if column in data.columns]).extend(data)
+
+# Per-ticker features kept between calls, so a history that only gained new
+# trading days is extended instead of rebuilt
+FEATURE_CACHE_SIZE = 128
+_feature_cache = OrderedDict()
+_feature_cache_lock = threading.Lock()
+
+# Features of `data`, reusing the cached features of `ticker` when `data`
+# extends them
+def ticker_features(ticker, data):
+    with _feature_cache_lock:
+        cached = _feature_cache.get(ticker)
+    if cached is not None and cached.is_prefix_of(data):
+        features = cached if len(data) == len(cached) else cached.extend(data.iloc[len(cached):])
+    else:
+        features = build_features(data)
+    with _feature_cache_lock:
+        _feature_cache[ticker] = features
+        _feature_cache.move_to_end(ticker)
+        while len(_feature_cache) > FEATURE_CACHE_SIZE:
+            _feature_cache.popitem(last=False)
+    return features
+
+# Function to create features for the forecasting models. Returns the
+# feature matrix X and the multi-horizon targets Y, indexed by trading day.
+def create_features(data, ticker=None):
+    if 'date' not in data.columns:
+        raise KeyError("The 'date' column is missing in the data passed to create_features.")
+    features = build_features(data) if ticker is None else ticker_features(ticker, data)
+    return features.frames()
+
+# Interface shared by all forecasting models. fit trains from scratch;
+# models with incremental = True can also absorb new trading days with update
+# instead of a full retrain. registry_params identifies a trained model in
+# the model registry, so it leaves out settings such as n_jobs that do not
+# change the model.
+class Forecaster:
+    name = 'base'
+    label = 'Base'
+    incremental = False
+
+    def registry_params(self):
+        return {'model': self.name}
+
+    def fit(self, X, y):
+        raise NotImplementedError
+
+    def update(self, X, y):
+        raise NotImplementedError
+
+    def predict(self, X):
+        raise NotImplementedError
+
+    # Build the forecaster from deployment settings; options a model does not
+    # have are ignored
+    @classmethod
+    def from_settings(cls, n_estimators=None, n_jobs=None):
+        return cls()
+
+# Random Forest refit from scratch whenever the ticker's prices change
+class RandomForestForecaster(Forecaster):
+    name = 'random_forest'
+    label = 'Random Forest Regressor'
+
+    def __init__(self, n_estimators=100, n_jobs=None, random_state=42):
+        self.n_estimators = n_estimators
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.model = None
+
+    def registry_params(self):
+        return {'model': self.name, 'n_estimators': self.n_estimators, 'random_state': self.random_state}
+
+    def fit(self, X, y):
+        self.model = RandomForestRegressor(n_estimators=self.n_estimators, n_jobs=self.n_jobs,
+                                           random_state=self.random_state)
+        self.model.fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+    @classmethod
+    def from_settings(cls, n_estimators=None, n_jobs=None):
+        return cls(n_estimators=n_estimators or 100, n_jobs=n_jobs)
+
+# Linear model trained with stochastic gradient descent, one per horizon day.
+# The scaler is fixed at the first fit; update() takes a partial_fit step over
+# the new days only.
+class OnlineLinearForecaster(Forecaster):
+    name = 'online_linear'
+    label = 'Online Linear Regression (SGD)'
+    incremental = True
+
+    def __init__(self, alpha=1e-4, max_iter=1000, random_state=42):
+        self.alpha = alpha
+        self.max_iter = max_iter
+        self.random_state = random_state
+        self.scaler = None
+        self.model = None
+
+    def registry_params(self):
+        return {'model': self.name, 'alpha': self.alpha, 'max_iter': self.max_iter, 'random_state': self.random_state}
+
+    def fit(self, X, y):
+        self.scaler = StandardScaler().fit(X)
+        self.model = MultiOutputRegressor(SGDRegressor(alpha=self.alpha, max_iter=self.max_iter,
+                                                       random_state=self.random_state))
+        self.model.fit(self.scaler.transform(X), y)
+        return self
+
+    def update(self, X, y):
+        self.model.partial_fit(self.scaler.transform(X), y)
+        return self
+
+    def predict(self, X):
+        return self.model.predict(self.scaler.transform(X))
+
+FORECASTERS = {
+    'random_forest': RandomForestForecaster,
+    'online_linear': OnlineLinearForecaster,
+}
+
+DEFAULT_FORECASTER = 'random_forest'
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+# The forecaster for this deployment. Arguments override the FORECAST_MODEL,
+# FORECAST_TREES and FORECAST_N_JOBS environment variables.
+def get_forecaster(name=None, n_estimators=None, n_jobs=None):
+    name = name or os.environ.get('FORECAST_MODEL') or DEFAULT_FORECASTER
+    if name not in FORECASTERS:
+        raise ValueError(f"Unknown forecaster: {name}")
+    return FORECASTERS[name].from_settings(n_estimators=n_estimators or _env_int('FORECAST_TREES'),
+                                           n_jobs=n_jobs or _env_int('FORECAST_N_JOBS'))
+
+# A fitted model with its out-of-sample forecasts (y_pred) and the actual
+# closes (y_true), one row per forecast day and one column per horizon day
+def _fitted(forecaster, trained_until, y_true, y_pred):
+    fitted = {'model': forecaster, 'trained_until': trained_until, 'y_true': y_true, 'y_pred': y_pred}
+    fitted['mae'], fitted['r_squared'] = horizon_scores(fitted, y_true.shape[1])
+    return fitted
+
+# MAE and R^2 of a fitted model's out-of-sample price forecasts over the
+# first `horizon` trading days
+def horizon_scores(fitted, horizon):
+    y_true = fitted['y_true'][:, :horizon].ravel()
+    y_pred = fitted['y_pred'][:, :horizon].ravel()
+    return mean_absolute_error(y_true, y_pred), r2_score(y_true, y_pred)
+
+# Turn predicted returns into prices from each row's close
+def to_prices(X, returns):
+    return X['close'].to_numpy()[:, None] * (1 + np.asarray(returns))
+
+# Days whose targets are all known, i.e. that can be trained on
+def _trainable(Y):
+    return Y.notna().all(axis=1).to_numpy()
+
+# Share of the trainable days held out to score a model
+TEST_SIZE = 0.2
+
+# End (exclusive) of the training rows for a test window starting at row
+# test_start. A row's targets reach MAX_HORIZON closes ahead, so the last
+# MAX_HORIZON - 1 rows before the window are purged: no training target then
+# reaches past the close of the window's first day.
+def purged_train_end(test_start):
+    return test_start - MAX_HORIZON + 1
+
+# Function to train a forecaster and score it on the most recent 20% of the
+# days it can be trained on, with the days before them purged as in the
+# backtests. Incremental models then absorb the purged and held-out days as
+# well.
+def fit_model(forecaster, X, Y):
+    trainable = _trainable(Y)
+    X, Y = X[trainable], Y[trainable]
+
+    # Purged train-test split
+    test_start = len(X) - math.ceil(len(X) * TEST_SIZE)
+    train_end = purged_train_end(test_start)
+    if train_end < 1 or test_start >= len(X):
+        raise ValueError(f"Not enough price history to train and score a model ({len(X)} trainable days).")
+    X_train, Y_train = X.iloc[:train_end], Y.iloc[:train_end]
+    X_test, Y_test = X.iloc[test_start:], Y.iloc[test_start:]
+
+    forecaster.fit(X_train, Y_train)
+    y_true, y_pred = to_prices(X_test, Y_test), to_prices(X_test, forecaster.predict(X_test))
+    if forecaster.incremental:
+        forecaster.update(X.iloc[train_end:], Y.iloc[train_end:])
+        return _fitted(forecaster, X.index[-1], y_true, y_pred)
+    return _fitted(forecaster, X_train.index[-1], y_true, y_pred)
+
+# Function to bring an incremental model up to date with the days whose
+# targets became known after it was last trained. Each new day is forecast
+# before it is absorbed, so the accuracy stays out-of-sample over a window as
+# long as the original test set. Returns None if the model cannot be
+# extended to this history.
+def update_model(fitted, X, Y):
+    if fitted['trained_until'] not in X.index:
+        return None
+    new = _trainable(Y) & (X.index > fitted['trained_until'])
+    if not new.any():
+        return fitted
+    forecaster = copy.deepcopy(fitted['model'])
+    y_true, y_pred = to_prices(X[new], Y[new]), to_prices(X[new], forecaster.predict(X[new]))
+    forecaster.update(X[new], Y[new])
+    window = len(fitted['y_true'])
+    return _fitted(forecaster, X.index[new][-1], np.vstack([fitted['y_true'], y_true])[-window:],
+                   np.vstack([fitted['y_pred'], y_pred])[-window:])
+
+# Function to get a fitted model. With a ticker and its price version the
+# model comes from (or goes to) the model registry, so an unchanged ticker
+# is only a load, and an incremental model from an older price version is
+# updated with the new days instead of retrained.
+def fit_forecaster(X, Y, ticker=None, data_version=None, forecaster=None):
+    forecaster = forecaster or get_forecaster()
+    if ticker is None or data_version is None:
+        return fit_model(forecaster, X, Y)
+
+    registry = get_model_registry()
+    params = forecaster.registry_params()
+
+    def fit():
+        if forecaster.incremental:
+            previous = registry.latest(ticker, FEATURE_VERSION, params)
+            fitted = update_model(previous, X, Y) if previous is not None else None
+            if fitted is not None:
+                return fitted
+        return fit_model(forecaster, X, Y)
+
+    return registry.get_or_fit(ticker, FEATURE_VERSION, data_version, params, fit)
+
+# Function to forecast the closes of the next trading days from the latest
+# day's features. One predict call covers every horizon; each horizon is a
+# prefix of the MAX_HORIZON-day path.
+def forecast_horizons(fitted, X, horizons=FORECAST_HORIZONS):
+    latest = X.tail(1)
+    path = to_prices(latest, fitted['model'].predict(latest))[0]
+    return {horizon: path[:horizon] for horizon in horizons}
+
+# Function to train the deployment's forecaster and forecast every horizon.
+# Returns {horizon: (forecast prices, MAE, R^2)}. `report(progress, message)`
+# is called before each step when given.
+def forecast_all_horizons(data, ticker=None, data_version=None, forecaster=None, horizons=FORECAST_HORIZONS,
+                          report=None):
+    forecaster = forecaster or get_forecaster()
+    report = report or (lambda progress, message: None)
+
+    # Prepare the features and targets
+    report(0.1, "Building features")
+    X, Y = create_features(data, ticker)
+
+    report(0.3, f"Training the {forecaster.label}")
+    fitted = fit_forecaster(X, Y, ticker, data_version, forecaster)
+
+    report(0.9, "Forecasting")
+    paths = forecast_horizons(fitted, X, horizons)
+    return {horizon: (paths[horizon], *horizon_scores(fitted, horizon)) for horizon in horizons}
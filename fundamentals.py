@@ -0,0 +1,88 @@
+import math
+import pandas as pd
+
+# Change-only (slowly changing dimension) storage for the financials table.
+# Each row holds one version of a ticker's fundamentals, valid from
+# valid_from up to (not including) valid_to; the current version has
+# valid_to NULL. A daily load that sees the same values writes nothing.
+
+FUNDAMENTAL_COLUMNS = ['market_cap', 'pe_ratio', 'revenue', 'net_income', 'earnings_per_share']
+
+def _same(old, new):
+    if old is None or new is None:
+        return old is None and new is None
+    if isinstance(old, float) and isinstance(new, float) and math.isnan(old) and math.isnan(new):
+        return True
+    return old == new
+
+# Store a batch of (ticker, date, market_cap, pe_ratio, revenue, net_income,
+# earnings_per_share) rows, writing only the ones whose values changed since
+# the ticker's current version. A change closes the current version at
+# `date`; a second change on the same date overwrites that day's version.
+# Rows older than the current version are ignored. Does not commit. Returns
+# the tickers whose fundamentals changed.
+def upsert_fundamentals(conn, rows):
+    if not rows:
+        return []
+    tickers = [row[0] for row in rows]
+    current = {}
+    for chunk_start in range(0, len(tickers), 500):
+        chunk = tickers[chunk_start:chunk_start + 500]
+        current.update((row[0], row[1:]) for row in conn.execute(
+            f'''SELECT ticker, valid_from, {', '.join(FUNDAMENTAL_COLUMNS)} FROM financials
+                WHERE valid_to IS NULL AND ticker IN ({','.join('?' * len(chunk))})''', chunk))
+
+    closes, inserts, changed = [], [], []
+    for ticker, date, *values in rows:
+        date = str(date)
+        if ticker in current:
+            valid_from, *old_values = current[ticker]
+            if date < valid_from or all(_same(old, new) for old, new in zip(old_values, values)):
+                continue
+            if date > valid_from:
+                closes.append((date, ticker))
+        inserts.append((ticker, date, *values))
+        current[ticker] = (date, *values)
+        changed.append(ticker)
+
+    conn.executemany("UPDATE financials SET valid_to = ? WHERE ticker = ? AND valid_to IS NULL", closes)
+    conn.executemany(f'''INSERT OR REPLACE INTO financials (ticker, valid_from, valid_to, {', '.join(FUNDAMENTAL_COLUMNS)})
+                         VALUES (?, ?, NULL, ?, ?, ?, ?, ?)''', inserts)
+    return changed
+
+def _ticker_filter(tickers, params):
+    if tickers is None:
+        return ""
+    tickers = list(tickers)
+    params.extend(tickers)
+    return f" AND ticker IN ({','.join('?' * len(tickers))})"
+
+# Current fundamentals of every ticker (or the given tickers)
+def get_latest_fundamentals(conn, tickers=None):
+    params = []
+    query = f'''SELECT ticker, valid_from, {', '.join(FUNDAMENTAL_COLUMNS)} FROM financials
+                WHERE valid_to IS NULL{_ticker_filter(tickers, params)}'''
+    return pd.read_sql(query, conn, params=params)
+
+# Fundamentals as they were on a given date, for every ticker that had any
+def get_fundamentals_as_of(conn, date, tickers=None):
+    date = pd.Timestamp(date).strftime('%Y-%m-%d')
+    params = [date, date]
+    query = f'''SELECT ticker, valid_from, {', '.join(FUNDAMENTAL_COLUMNS)} FROM financials
+                WHERE valid_from <= ? AND (valid_to IS NULL OR valid_to > ?){_ticker_filter(tickers, params)}'''
+    return pd.read_sql(query, conn, params=params)
+
+# Migration helper: rebuild a (ticker, date) snapshot-per-day financials
+# table as change-only versions in financials_versions
+def collapse_financials_history(conn):
+    rows = conn.execute(f'''SELECT ticker, date, {', '.join(FUNDAMENTAL_COLUMNS)} FROM financials
+                            ORDER BY ticker, date''').fetchall()
+    versions = []
+    for ticker, date, *values in rows:
+        if versions and versions[-1][0] == ticker:
+            if all(_same(old, new) for old, new in zip(versions[-1][3:], values)):
+                continue
+            versions[-1][2] = date
+        versions.append([ticker, date, None, *values])
+    conn.executemany(f'''INSERT INTO financials_versions (ticker, valid_from, valid_to, {', '.join(FUNDAMENTAL_COLUMNS)})
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', versions)
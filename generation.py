@@ -0,0 +1,43 @@
+from db import get_read_connection
+
+# Data generation: a counter in the metadata table that the loaders bump in
+# the same transaction as every write to the price, fundamentals and rollup
+# tables. Anything derived from the data (the in-memory price cube, cached
+# frames and figures) is valid for exactly one generation, so comparing the
+# counter is enough to know it is stale.
+
+DATA_GENERATION_KEY = 'data_generation'
+
+# Current data generation (0 before anything has been published)
+def get_data_generation(conn):
+    row = conn.execute("SELECT value FROM metadata WHERE key = ?", (DATA_GENERATION_KEY,)).fetchone()
+    return row[0] if row else 0
+
+# Publish a new generation and return it. Does not commit: call it inside
+# the write's transaction so readers never see new data under the old
+# generation.
+def bump_data_generation(conn):
+    conn.execute('''INSERT INTO metadata (key, value) VALUES (?, 1)
+                    ON CONFLICT (key) DO UPDATE SET value = value + 1''', (DATA_GENERATION_KEY,))
+    return get_data_generation(conn)
+
+# Per-ticker price versions: the generation in which each ticker's prices
+# last changed, kept in price_versions by price_store.write_price_frames.
+# Anything derived from one ticker's prices alone is stamped with it, so
+# writes to other tickers or other tables leave it valid.
+
+# Record that the given tickers' prices changed in `generation`. Does not commit.
+def stamp_price_versions(conn, tickers, generation):
+    conn.executemany("INSERT OR REPLACE INTO price_versions (ticker, data_version) VALUES (?, ?)",
+                     [(ticker, generation) for ticker in tickers])
+
+# A ticker's current price version (0 if it has no prices)
+def get_price_version(conn, ticker):
+    row = conn.execute("SELECT data_version FROM price_versions WHERE ticker = ?", (ticker,)).fetchone()
+    return row[0] if row else 0
+
+# The dashboard's single cache key. Every cached query, frame and figure takes
+# the current generation as an argument, so caches never need a TTL: the
+# first page run after a loader commits simply misses and rebuilds.
+def current_generation():
+    return get_data_generation(get_read_connection())
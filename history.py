@@ -0,0 +1,73 @@
+from functools import lru_cache
+import pandas as pd
+from db import get_read_connection
+from generation import current_generation, get_price_version
+from price_cube import CUBE_FIELDS, get_price_cube
+from columnar_store import read_ticker_history
+
+# Windowed, column-projected price history for one ticker. Results are kept
+# in a bounded LRU keyed by (ticker, window, columns, data generation), so a
+# rerun of the same page is a dictionary lookup and new data is picked up as
+# soon as a loader publishes a new generation.
+HISTORY_CACHE_SIZE = 128
+
+# Columns that may be requested; anything else is ignored so that column
+# names never reach the SQL text from the caller
+HISTORY_COLUMNS = CUBE_FIELDS
+
+def _project(columns):
+    if columns is None:
+        return tuple(HISTORY_COLUMNS)
+    return tuple(column for column in HISTORY_COLUMNS if column in columns)
+
+def _window_key(date):
+    return None if date is None else pd.Timestamp(date).strftime('%Y-%m-%d')
+
+# Read the history straight from SQLite with a parameterized query
+def read_sqlite_history(conn, ticker, start=None, end=None, columns=None):
+    columns = _project(columns)
+    query = f"SELECT ticker, date{''.join(', ' + column for column in columns)} FROM stock_prices WHERE ticker = ?"
+    params = [ticker]
+    if start is not None:
+        query += " AND date >= ?"
+        params.append(_window_key(start))
+    if end is not None:
+        query += " AND date <= ?"
+        params.append(_window_key(end))
+    data = pd.read_sql(query + " ORDER BY date", conn, params=params)
+    data['date'] = pd.to_datetime(data['date'])
+    return data
+
+# Read the history from the columnar mirror while it holds the ticker's
+# current price version, otherwise from SQLite. The batch jobs (forecasts,
+# backtests) read every ticker through this, since they have no price cube.
+def read_history(conn, ticker, start=None, end=None, columns=None):
+    columns = _project(columns)
+    data = read_ticker_history(ticker, get_price_version(conn, ticker), columns)
+    if data is None:
+        return read_sqlite_history(conn, ticker, start, end, columns)
+    if start is not None:
+        data = data[data['date'] >= pd.Timestamp(start)]
+    if end is not None:
+        data = data[data['date'] <= pd.Timestamp(end)]
+    return data.reset_index(drop=True)
+
+# Fill the cache from the in-memory price cube, falling back to the columnar
+# mirror and SQLite for tickers the cube does not hold
+@lru_cache(maxsize=HISTORY_CACHE_SIZE)
+def _load_history(ticker, start, end, columns, generation):
+    data = get_price_cube().history(ticker, start, end, columns)
+    if data is not None:
+        return data
+    return read_history(get_read_connection(), ticker, start, end, columns)
+
+# Price history of one ticker between start and end (inclusive, either may be
+# None) with the requested price columns. Returns a copy, so callers may
+# modify it freely without touching the cached frame.
+def load_history(ticker, start=None, end=None, columns=None):
+    generation = current_generation()
+    data = _load_history(ticker, _window_key(start), _window_key(end), _project(columns), generation)
+    return data.copy()
+
+def clear_history_cache():
+    _load_history.cache_clear()
@@ -0,0 +1,69 @@
+import pandas as pd
+
+# Ingestion journal: one row per run and one row per (run, ticker) recording
+# status, attempt count, last error and rows written, so an interrupted run
+# can resume where it stopped and a finished run can re-run only its failures.
+# The ingestion_runs and ingestion_journal tables are created by schema.py.
+
+def _now():
+    return pd.Timestamp.now().isoformat(timespec='seconds')
+
+# Start a new run with every ticker pending
+def start_run(conn, job, tickers):
+    with conn:
+        run_id = conn.execute("INSERT INTO ingestion_runs (job, status, started_at) VALUES (?, 'running', ?)",
+                              (job, _now())).lastrowid
+        conn.executemany("INSERT INTO ingestion_journal (run_id, ticker, status) VALUES (?, ?, 'pending')",
+                         [(run_id, ticker) for ticker in tickers])
+    return run_id
+
+# Latest run of a job that never finished, or None
+def find_unfinished_run(conn, job):
+    row = conn.execute("SELECT run_id FROM ingestion_runs WHERE job = ? AND status = 'running' "
+                       "ORDER BY run_id DESC LIMIT 1", (job,)).fetchone()
+    return row[0] if row else None
+
+# Reopen the failed tickers of the latest run of a job so they can be retried.
+# Returns the run id, or None if the job has never run.
+def reopen_failed(conn, job):
+    row = conn.execute("SELECT run_id FROM ingestion_runs WHERE job = ? ORDER BY run_id DESC LIMIT 1",
+                       (job,)).fetchone()
+    if row is None:
+        return None
+    run_id = row[0]
+    with conn:
+        conn.execute("UPDATE ingestion_journal SET status = 'pending' WHERE run_id = ? AND status = 'failed'",
+                     (run_id,))
+        conn.execute("UPDATE ingestion_runs SET status = 'running', finished_at = NULL WHERE run_id = ?",
+                     (run_id,))
+    return run_id
+
+# Tickers of a run that still need work, in their original order
+def pending_tickers(conn, run_id):
+    rows = conn.execute("SELECT ticker FROM ingestion_journal WHERE run_id = ? AND status != 'done' ORDER BY rowid",
+                        (run_id,)).fetchall()
+    return [row[0] for row in rows]
+
+# Mark a ticker done. Does not commit: call it just before the price write so
+# that both land in the same transaction.
+def record_success(conn, run_id, ticker, rows_written):
+    conn.execute('''UPDATE ingestion_journal
+                    SET status = 'done', attempts = attempts + 1, last_error = NULL,
+                        rows_written = ?, updated_at = ?
+                    WHERE run_id = ? AND ticker = ?''', (rows_written, _now(), run_id, ticker))
+
+# Mark a ticker failed and keep the error
+def record_failure(conn, run_id, ticker, error):
+    with conn:
+        conn.execute('''UPDATE ingestion_journal
+                        SET status = 'failed', attempts = attempts + 1, last_error = ?, updated_at = ?
+                        WHERE run_id = ? AND ticker = ?''', (str(error), _now(), run_id, ticker))
+
+# Close a run and summarise its journal as {status: count}
+def finish_run(conn, run_id):
+    with conn:
+        conn.execute("UPDATE ingestion_runs SET status = 'finished', finished_at = ? WHERE run_id = ?",
+                     (_now(), run_id))
+    rows = conn.execute("SELECT status, COUNT(*) FROM ingestion_journal WHERE run_id = ? GROUP BY status",
+                        (run_id,)).fetchall()
+    return dict(rows)
@@ -1,34 +1,25 @@
-import sqlite3
-import yfinance as yf
 import pandas as pd
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from fetch_utils import TokenBucket, fetch_with_retries
+from market_data import YFinanceProvider, add_provider_arguments, provider_from_args
+from db import open_write_connection
+from schema import migrate
+from rollups import refresh_latest_snapshot, refresh_sector_stats
+from generation import bump_data_generation
+from risk_engine import refresh_risk_scores
+from screener import refresh_screener_metrics
+from fundamentals import upsert_fundamentals
 
 # Connect to SQLite database (or any other DB you're using)
-conn = sqlite3.connect('klse_tickers.db')  # Replace with your DB name
+conn = open_write_connection()
 cursor = conn.cursor()
 
-# 1. Define Table Creation Queries (for companies and financials)
+# 1. Create or upgrade the tables (schema.py owns the table definitions)
 def create_tables():
-    # Create companies table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS companies (
-                        ticker TEXT PRIMARY KEY,
-                        name TEXT NOT NULL,
-                        category TEXT
-                    )''')
-
-    # Create financials table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS financials (
-                        ticker TEXT,
-                        date DATE,
-                        market_cap REAL,
-                        pe_ratio REAL,
-                        revenue REAL,
-                        net_income REAL,
-                        earnings_per_share REAL,
-                        PRIMARY KEY (ticker, date),
-                        FOREIGN KEY (ticker) REFERENCES companies(ticker)
-                    )''')
-
-    conn.commit()
+    migrate(conn)
 
 # 2. Load tickers and their categories from klse_tickers.csv
 def load_tickers_and_categories_from_csv(file_path='klse_tickers.csv'):
@@ -36,40 +27,57 @@ def load_tickers_and_categories_from_csv(file_path='klse_tickers.csv'):
     df = pd.read_csv(file_path)
     return df[['Ticker', 'Category']].to_dict('records')  
 
+# Build the companies and financials rows for one ticker from company.info
+def build_fundamental_rows(ticker, category_from_csv, info, date):
+    name = info.get('longName', 'N/A')
+
+    # Use Category from CSV (fall back to Yahoo Finance only if CSV Category is missing)
+    category = category_from_csv if category_from_csv else info.get('sector', 'N/A')
+
+    # Fetch financial data directly from company.info
+    market_cap = info.get('marketCap', 0)
+    pe_ratio = info.get('trailingPE', 0)
+    revenue = info.get('totalRevenue', 0)
+    net_income = info.get('netIncomeToCommon', 0)
+    eps = info.get('trailingEps', 0)
+
+    return (ticker, name, category), (ticker, date, market_cap, pe_ratio, revenue, net_income, eps)
+
+# Write a batch of fundamentals into companies and financials in one transaction
+# (financials only gets the values that changed). Returns True if a company was
+# added or any financials changed; the run publishes a single data generation
+# at the end, and only if some batch changed something.
+def write_fundamentals(rows):
+    if not rows:
+        return False
+    with conn:
+        before = conn.total_changes
+        conn.executemany('''INSERT OR IGNORE INTO companies (ticker, name, category)
+                            VALUES (?, ?, ?)''', [company_row for company_row, _ in rows])
+        added = conn.total_changes > before
+        changed = upsert_fundamentals(conn, [financial_row for _, financial_row in rows])
+        # Newly added companies may already have prices
+        if added:
+            refresh_latest_snapshot(conn, [company_row[0] for company_row, _ in rows])
+        if changed:
+            refresh_sector_stats(conn, changed)
+    return added or bool(changed)
+
 # 3. Fetch Data from Yahoo Finance and Insert Into Tables
-def fetch_and_insert_data(tickers_with_categories):
+def fetch_and_insert_data(tickers_with_categories, provider=None):
+    provider = provider or YFinanceProvider()
     error_occurred = False  # To track if any error happens
+    updated = False  # To track if anything was written
+    today = pd.to_datetime('today').date()
     
     for record in tickers_with_categories:
         ticker = record['Ticker']
         category_from_csv = record['Category']  # Use Category from CSV
 
         try:
-            # Fetch basic company info (name, ticker)
-            company = yf.Ticker(ticker)
-            info = company.info
-            name = info.get('longName', 'N/A')
-            
-            # Use Category from CSV (fall back to Yahoo Finance only if CSV Category is missing)
-            category = category_from_csv if category_from_csv else info.get('sector', 'N/A')
-
-            # Insert basic info into companies table
-            cursor.execute('''INSERT OR IGNORE INTO companies (ticker, name, category)
-                              VALUES (?, ?, ?)''', (ticker, name, category))
-            
-            # Fetch financial data directly from company.info
-            market_cap = info.get('marketCap', 0)
-            pe_ratio = info.get('trailingPE', 0)
-            revenue = info.get('totalRevenue', 0)
-            net_income = info.get('netIncomeToCommon', 0)
-            eps = info.get('trailingEps', 0)
-
-            # Insert the financial data into the financials table
-            cursor.execute('''INSERT OR REPLACE INTO financials (ticker, date, market_cap, pe_ratio, revenue, net_income, earnings_per_share)
-                              VALUES (?, ?, ?, ?, ?, ?, ?)''', 
-                           (ticker, pd.to_datetime('today').date(), market_cap, pe_ratio, revenue, net_income, eps))
-
-            conn.commit()
+            # Fetch basic company info (name, ticker) and financial data
+            info = provider.get_info(ticker)
+            updated = write_fundamentals([build_fundamental_rows(ticker, category_from_csv, info, today)]) or updated
             
         except Exception as e:
             error_occurred = True
@@ -79,10 +87,75 @@ def fetch_and_insert_data(tickers_with_categories):
         print("All data fetched and inserted successfully.")
     else:
         print("Some errors occurred during the process. Please check the logs.")
+    return updated
+
+# 3b. Fetch fundamentals concurrently. Workers share one token bucket so the
+# request rate stays inside the provider's limits, each ticker gets retries
+# with jittered exponential backoff and a per-attempt timeout, and the main
+# thread writes the results in batches. Returns (tickers fetched, failed
+# tickers, whether anything was written).
+def fetch_and_insert_data_concurrently(tickers_with_categories, max_workers=8, rate=2.0, burst=5,
+                                       retries=3, timeout=30, write_batch_size=50, provider=None):
+    provider = provider or YFinanceProvider()
+    limiter = TokenBucket(rate, burst)
+    today = pd.to_datetime('today').date()
+    pending_rows = []
+    failed = []
+    updated = False
+    start_time = time.perf_counter()
+
+    def fetch(record):
+        info, _ = fetch_with_retries(lambda: provider.get_info(record['Ticker']), limiter=limiter,
+                                     retries=retries, timeout=timeout)
+        return build_fundamental_rows(record['Ticker'], record['Category'], info, today)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=len(tickers_with_categories), desc="Fetching fundamentals", unit="ticker") as pbar:
+        futures = {executor.submit(fetch, record): record['Ticker'] for record in tickers_with_categories}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                pending_rows.append(future.result())
+            except Exception as e:
+                failed.append(ticker)
+                print(f"Error occurred while processing {ticker}: {e}")
+            finally:
+                pbar.update(1)
+
+            if len(pending_rows) >= write_batch_size:
+                updated = write_fundamentals(pending_rows) or updated
+                pending_rows = []
+
+    updated = write_fundamentals(pending_rows) or updated
+
+    elapsed = time.perf_counter() - start_time
+    fetched = len(tickers_with_categories) - len(failed)
+    rate_achieved = len(tickers_with_categories) / elapsed if elapsed > 0 else float('inf')
+    print(f"Fetched fundamentals for {fetched} of {len(tickers_with_categories)} tickers "
+          f"in {elapsed:.1f}s ({rate_achieved:.1f} tickers/s)")
+    if failed:
+        print("Some errors occurred during the process. Please check the logs.")
+    else:
+        print("All data fetched and inserted successfully.")
+    return fetched, failed, updated
+
+# Command-line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch KLSE company fundamentals into companies/financials.")
+    parser.add_argument('--serial', action='store_true', help="Fetch one ticker at a time")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent fetch workers")
+    parser.add_argument('--rate', type=float, default=2.0, help="Sustained requests per second across all workers")
+    parser.add_argument('--burst', type=int, default=5, help="Requests allowed in a burst above the sustained rate")
+    parser.add_argument('--retries', type=int, default=3, help="Retries per ticker after the first attempt")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds allowed per fetch attempt")
+    add_provider_arguments(parser)
+    return parser.parse_args()
 
 # Main Function
 if __name__ == "__main__":
     try:
+        args = parse_args()
+
         # Load tickers and their categories from the CSV file
         tickers_with_categories = load_tickers_and_categories_from_csv('klse_tickers.csv')  # Specify your CSV path if needed
         
@@ -90,7 +163,25 @@ if __name__ == "__main__":
         create_tables()
         
         # Fetch data from Yahoo Finance and insert into database
-        fetch_and_insert_data(tickers_with_categories)
+        provider = provider_from_args(args)
+        if args.serial:
+            updated = fetch_and_insert_data(tickers_with_categories, provider=provider)
+        else:
+            _, _, updated = fetch_and_insert_data_concurrently(tickers_with_categories, max_workers=args.workers,
+                                                               rate=args.rate, burst=args.burst, retries=args.retries,
+                                                               timeout=args.timeout, provider=provider)
+
+        # The risk scores and screener metrics depend on the fundamentals just
+        # written; the whole run publishes one data generation, and none if
+        # nothing changed
+        if updated:
+            with conn:
+                scored = refresh_risk_scores(conn)
+                refresh_screener_metrics(conn)
+                bump_data_generation(conn)
+            print(f"Refreshed risk scores for {scored} tickers")
+        else:
+            print("No fundamentals changed; caches and scores left as they are.")
 
     except Exception as e:
         print(f"An error occurred during the setup or execution: {e}")
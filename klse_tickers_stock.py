@@ -1,24 +1,39 @@
-import sqlite3
-import yfinance as yf
 import pandas as pd
 import time
+import argparse
 from tqdm import tqdm
+from price_store import DEFAULT_OVERLAP_DAYS, WriteStats, bulk_load_pragmas, get_price_watermarks, incremental_start_date
+from market_data import YFinanceProvider, add_provider_arguments, provider_from_args
+from db import open_write_connection
+from schema import migrate
+from rollups import refresh_sector_daily
+from generation import bump_data_generation
+from risk_engine import refresh_risk_scores
+from screener import refresh_screener_metrics
+from columnar_store import export_tickers
 
 # Connect to SQLite database
-conn = sqlite3.connect('klse_tickers.db')
+conn = open_write_connection()
 cursor = conn.cursor()
 
-# Fetch historical data for specific stocks based on their available data
-def fetch_data_for_new_stocks(tickers):
+# Fetch historical data for specific stocks based on their available data.
+# In incremental mode only the days after the latest stored date are fetched.
+def fetch_data_for_new_stocks(tickers, incremental=False, overlap_days=DEFAULT_OVERLAP_DAYS, provider=None):
+    provider = provider or YFinanceProvider()
+    watermarks = get_price_watermarks(conn, tickers) if incremental else {}
+    stats = WriteStats()
+
     for ticker in tickers:
         try:
-            # Fetch the data using Yahoo Finance
-            company = yf.Ticker(ticker)
-            stock_data = company.history(period='max')  # Fetch max available data
+            # Fetch the data from the market-data provider: max available data,
+            # or only from just before the watermark in incremental mode
+            start = incremental_start_date(watermarks.get(ticker), overlap_days)
+            frames = provider.download_prices([ticker], period='max', start=start)
 
-            # Convert the index to timezone-naive if it's timezone-aware
-            if stock_data.index.tz is not None:
-                stock_data.index = stock_data.index.tz_localize(None)  # Make index timezone-naive
+            if ticker not in frames:
+                print(f"No new data for {ticker}")
+                continue
+            stock_data = frames[ticker]  # Providers return a timezone-naive index
 
             # Calculate the date range to fetch, either 1 year or based on the available data
             start_date = stock_data.index.min().date()  # Get the earliest available date
@@ -28,25 +43,47 @@ def fetch_data_for_new_stocks(tickers):
             stock_data_filtered = stock_data.loc[start_date:end_date]
 
             # Insert data into stock_prices table
-            for date, row in stock_data_filtered.iterrows():
-                cursor.execute('''INSERT OR REPLACE INTO stock_prices (ticker, date, open, close, high, low, volume)
-                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                               (ticker, date.date(), row['Open'], row['Close'], row['High'], row['Low'], row['Volume']))
-            
-            conn.commit()
+            stats.write(conn, {ticker: stock_data_filtered})
             print(f"Data fetched for {ticker} from {start_date} to {end_date}")
         
         except Exception as e:
             print(f"Error fetching data for {ticker}: {e}")
 
+    print(stats.report())
+
+# Command-line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch the full price history for newly listed stocks.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fetch trading days after each ticker's latest stored date")
+    parser.add_argument('--columnar', action='store_true',
+                        help="Also refresh the Arrow mirror (price_columns/) of the fetched tickers; needs pyarrow")
+    add_provider_arguments(parser)
+    return parser.parse_args()
+
 # Main function
 if __name__ == "__main__":
     try:
+        args = parse_args()
+        migrate(conn)
+
         # Specify the new stocks
         new_stocks = ['0325.KL', '5326.KL', '5329.KL']
         
         # Fetch and insert data for the new stocks
-        fetch_data_for_new_stocks(new_stocks)
+        with bulk_load_pragmas(conn):
+            fetch_data_for_new_stocks(new_stocks, incremental=args.incremental, provider=provider_from_args(args))
+            with conn:
+                refreshed = refresh_sector_daily(conn)
+                if refreshed:
+                    scored = refresh_risk_scores(conn)
+                    refresh_screener_metrics(conn)
+                    bump_data_generation(conn)
+            print(f"Refreshed sector rollups for {refreshed} trading days")
+            if refreshed:
+                print(f"Refreshed risk scores for {scored} tickers")
+        if args.columnar:
+            print(f"Exported {export_tickers(conn, new_stocks)} tickers to the columnar mirror")
         print("Data fetched for new stocks successfully.")
         
     except Exception as e:
@@ -1,45 +1,59 @@
-import sqlite3
-import yfinance as yf
 import pandas as pd
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm  # Progress bar library
+from price_store import (DEFAULT_OVERLAP_DAYS, WriteStats, bulk_load_pragmas, get_price_watermarks,
+                         group_tickers_by_start_date, incremental_start_date)
+from ingest_journal import (find_unfinished_run, finish_run, pending_tickers,
+                            record_failure, record_success, reopen_failed, start_run)
+from market_data import YFinanceProvider, add_provider_arguments, provider_from_args
+from db import open_write_connection
+from schema import migrate
+from rollups import refresh_sector_daily
+from generation import bump_data_generation
+from risk_engine import refresh_risk_scores
+from screener import refresh_screener_metrics
+from columnar_store import export_tickers
+
+# Journal job name for this loader
+JOURNAL_JOB = 'stock_prices'
 
 # Connect to SQLite database
-conn = sqlite3.connect('klse_tickers.db')
+conn = open_write_connection()
 cursor = conn.cursor()
 
-# Create stock_prices table
-cursor.execute('''CREATE TABLE IF NOT EXISTS stock_prices (
-                    ticker TEXT,
-                    date DATE,
-                    open REAL,
-                    close REAL,
-                    high REAL,
-                    low REAL,
-                    volume INTEGER,
-                    PRIMARY KEY (ticker, date),
-                    FOREIGN KEY (ticker) REFERENCES companies(ticker)
-                )''')
-conn.commit()
-
-# Create necessary indexes
+# Create or upgrade the tables and indexes (schema.py owns the schema)
 def create_indexes():
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_category ON companies (category);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_name ON companies (name);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticker_companies ON companies (ticker);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticker_prices ON stock_prices (ticker);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_date_prices ON stock_prices (date);")
-    conn.commit()
-    print("Indexes created successfully.")
+    migrate(conn)
+    print("Schema is up to date.")
 
 # Fetch tickers from the database
 def get_tickers_from_db():
     cursor.execute("SELECT ticker FROM companies")
     return [row[0] for row in cursor.fetchall()]
 
+# Write fetched frames and mark their tickers done in the journal, in one transaction
+def write_and_record(stats, frames, run_id=None):
+    if run_id is not None:
+        for ticker, stock_data in frames.items():
+            record_success(conn, run_id, ticker, len(stock_data))
+    stats.write(conn, frames)
+    conn.commit()
+
+# Record a failed ticker in the journal (if any) and print it
+def report_failure(ticker, error, run_id=None):
+    if run_id is not None:
+        record_failure(conn, run_id, ticker, error)
+    print(f"Error fetching data for {ticker}: {error}")
+
 # Fetch historical stock prices in batches with progress bar
-def fetch_historical_prices_in_batches(tickers, batch_size=50, delay=5):
+def fetch_historical_prices_in_batches(tickers, batch_size=50, delay=5, incremental=False, overlap_days=DEFAULT_OVERLAP_DAYS,
+                                       run_id=None, provider=None):
+    provider = provider or YFinanceProvider()
     total_tickers = len(tickers)
+    watermarks = get_price_watermarks(conn, tickers) if incremental else {}
+    stats = WriteStats()
     total_batches = (total_tickers - 1) // batch_size + 1
 
     for i in range(0, total_tickers, batch_size):
@@ -49,19 +63,17 @@ def fetch_historical_prices_in_batches(tickers, batch_size=50, delay=5):
         with tqdm(total=len(batch), desc="Fetching tickers in batch", unit="ticker") as pbar:
             for ticker in batch:
                 try:
-                    # Fetch historical data for the past year
-                    company = yf.Ticker(ticker)
-                    stock_data = company.history(period='1y')
+                    # Fetch historical data for the past year, or only the days since the watermark
+                    start = incremental_start_date(watermarks.get(ticker), overlap_days)
+                    frames = provider.download_prices([ticker], period='1y', start=start)
                     
                     # Insert data into stock_prices table
-                    for date, row in stock_data.iterrows():
-                        cursor.execute('''INSERT OR REPLACE INTO stock_prices (ticker, date, open, close, high, low, volume)
-                                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                       (ticker, date.date(), row['Open'], row['Close'], row['High'], row['Low'], row['Volume']))
-                    
-                    conn.commit()
+                    if ticker not in frames:
+                        report_failure(ticker, "no data returned", run_id)
+                    else:
+                        write_and_record(stats, frames, run_id)
                 except Exception as e:
-                    print(f"Error fetching data for {ticker}: {e}")
+                    report_failure(ticker, e, run_id)
                 finally:
                     pbar.update(1)  # Update progress bar for each ticker
         
@@ -70,16 +82,133 @@ def fetch_historical_prices_in_batches(tickers, batch_size=50, delay=5):
             print(f"Batch {i // batch_size + 1} completed. Waiting for {delay} seconds before next batch...")
             time.sleep(delay)
 
+    print(stats.report())
+
+# Split the ticker list into fixed-size batches
+def split_into_batches(tickers, batch_size):
+    return [tickers[i:i + batch_size] for i in range(0, len(tickers), batch_size)]
+
+# Plan the batch downloads. In incremental mode tickers are grouped by their
+# watermark so each batch shares one start date; new tickers get the full period.
+def plan_batches(tickers, batch_size, incremental=False, overlap_days=DEFAULT_OVERLAP_DAYS):
+    if not incremental:
+        return [(batch, None) for batch in split_into_batches(tickers, batch_size)]
+
+    watermarks = get_price_watermarks(conn, tickers)
+    groups = group_tickers_by_start_date(tickers, watermarks, overlap_days)
+    return [(batch, start) for start, group in groups.items() for batch in split_into_batches(group, batch_size)]
+
+# Fetch historical stock prices in bulk: one request per batch, batches run on
+# a bounded worker pool, and all database writes stay on the calling thread
+def fetch_historical_prices_bulk(tickers, batch_size=50, max_workers=4, period='1y', provider=None,
+                                 incremental=False, overlap_days=DEFAULT_OVERLAP_DAYS, run_id=None):
+    provider = provider or YFinanceProvider()
+    batches = plan_batches(tickers, batch_size, incremental, overlap_days)
+    fetched = 0
+    failed = []
+    stats = WriteStats()
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=len(tickers), desc="Fetching tickers", unit="ticker") as pbar:
+        futures = {executor.submit(provider.download_prices, batch, period, start): batch for batch, start in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                frames = future.result()
+                write_and_record(stats, frames, run_id)
+                fetched += len(frames)
+                missing = [ticker for ticker in batch if ticker not in frames]
+                if run_id is not None:
+                    for ticker in missing:
+                        record_failure(conn, run_id, ticker, "no data returned")
+                failed.extend(missing)
+            except Exception as e:
+                print(f"Error fetching batch starting at {batch[0]}: {e}")
+                if run_id is not None:
+                    for ticker in batch:
+                        record_failure(conn, run_id, ticker, e)
+                failed.extend(batch)
+            finally:
+                pbar.update(len(batch))
+
+    elapsed = time.perf_counter() - start_time
+    rate = len(tickers) / elapsed if elapsed > 0 else float('inf')
+    print(f"Fetched {fetched} of {len(tickers)} tickers in {elapsed:.1f}s ({rate:.1f} tickers/s)")
+    print(stats.report())
+    if failed:
+        print(f"No data for {len(failed)} tickers: {', '.join(failed[:10])}{' ...' if len(failed) > 10 else ''}")
+    return fetched, failed
+
+# Command-line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch historical KLSE stock prices into stock_prices.")
+    parser.add_argument('--mode', choices=['bulk', 'serial'], default='bulk',
+                        help="bulk: one multi-ticker request per batch on a worker pool; serial: one ticker at a time")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent batch downloads in bulk mode")
+    parser.add_argument('--delay', type=int, default=5, help="Seconds to wait between batches in serial mode")
+    parser.add_argument('--columnar', action='store_true',
+                        help="Also refresh the Arrow mirror (price_columns/) of the fetched tickers; needs pyarrow")
+    add_provider_arguments(parser)
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fetch trading days after each ticker's latest stored date")
+    parser.add_argument('--overlap-days', type=int, default=DEFAULT_OVERLAP_DAYS,
+                        help="Trading days re-fetched before the watermark to pick up late corrections")
+    resume = parser.add_mutually_exclusive_group()
+    resume.add_argument('--resume', action='store_true',
+                        help="Continue the last unfinished run, skipping tickers it already completed")
+    resume.add_argument('--retry-failed', action='store_true',
+                        help="Re-run only the tickers that failed in the last run")
+    return parser.parse_args()
+
 # Main function
 if __name__ == "__main__":
     try:
-        # Create indexes
+        # Create tables and indexes
         create_indexes()
         
+        args = parse_args()
+
+        # Pick the tickers for this run from the journal, or start a new run
+        run_id = None
+        if args.resume:
+            run_id = find_unfinished_run(conn, JOURNAL_JOB)
+        elif args.retry_failed:
+            run_id = reopen_failed(conn, JOURNAL_JOB)
+        if run_id is None:
+            if args.resume or args.retry_failed:
+                print("No previous run to continue; starting a new run.")
+            run_id = start_run(conn, JOURNAL_JOB, get_tickers_from_db())
+        tickers = pending_tickers(conn, run_id)
+        print(f"Run {run_id}: {len(tickers)} tickers to fetch")
+
         # Fetch tickers and process batches with progress bar
-        tickers = get_tickers_from_db()
-        fetch_historical_prices_in_batches(tickers, batch_size=50, delay=5)
-        print("All stock prices fetched successfully.")
+        provider = provider_from_args(args)
+        with bulk_load_pragmas(conn):
+            if args.mode == 'bulk':
+                fetch_historical_prices_bulk(tickers, batch_size=args.batch_size, max_workers=args.workers, provider=provider,
+                                             incremental=args.incremental, overlap_days=args.overlap_days, run_id=run_id)
+            else:
+                fetch_historical_prices_in_batches(tickers, batch_size=args.batch_size, delay=args.delay,
+                                                   incremental=args.incremental, overlap_days=args.overlap_days, run_id=run_id,
+                                                   provider=provider)
+            with conn:
+                refreshed = refresh_sector_daily(conn)
+                if refreshed:
+                    scored = refresh_risk_scores(conn)
+                    refresh_screener_metrics(conn)
+                    bump_data_generation(conn)
+            print(f"Refreshed sector rollups for {refreshed} trading days")
+            if refreshed:
+                print(f"Refreshed risk scores for {scored} tickers")
+        if args.columnar:
+            print(f"Exported {export_tickers(conn, tickers)} tickers to the columnar mirror")
+        summary = finish_run(conn, run_id)
+        if summary.get('failed'):
+            print(f"{summary['failed']} tickers failed; re-run with --retry-failed to fetch only those.")
+        else:
+            print("All stock prices fetched successfully.")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import zlib
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+# Columns every provider returns for price history, indexed by a tz-naive date
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Earliest date covered by a provider period, or None for the full history
+PERIOD_OFFSETS = {
+    '5d': pd.DateOffset(days=5), '1mo': pd.DateOffset(months=1), '3mo': pd.DateOffset(months=3),
+    '6mo': pd.DateOffset(months=6), '1y': pd.DateOffset(years=1), '2y': pd.DateOffset(years=2),
+    '5y': pd.DateOffset(years=5), '10y': pd.DateOffset(years=10), 'max': None,
+}
+
+def period_start(period):
+    if period not in PERIOD_OFFSETS:
+        raise ValueError(f"Unsupported period: {period}")
+    offset = PERIOD_OFFSETS[period]
+    return None if offset is None else pd.to_datetime('today').normalize() - offset
+
+# Keep only the rows inside a period or after a start date
+def slice_window(frame, period='1y', start=None):
+    first = pd.Timestamp(start) if start is not None else period_start(period)
+    return frame if first is None else frame[frame.index >= first]
+
+# Split a yf.download(..., group_by='ticker') frame into one frame per ticker
+def split_bulk_frame(data, batch):
+    frames = {}
+    if data is None or data.empty:
+        return frames
+
+    if isinstance(data.columns, pd.MultiIndex):
+        available = set(data.columns.get_level_values(0))
+        for ticker in batch:
+            if ticker in available:
+                frame = data[ticker].dropna(how='all')
+                if not frame.empty:
+                    frames[ticker] = frame
+    elif len(batch) == 1:
+        frame = data.dropna(how='all')
+        if not frame.empty:
+            frames[batch[0]] = frame
+    return frames
+
+
+# Interface shared by all market-data backends. download_prices returns
+# {ticker: frame} for the tickers that had data; get_info returns the same
+# dictionary shape as yfinance's Ticker.info.
+class MarketDataProvider:
+    name = 'base'
+
+    def download_prices(self, tickers, period='1y', start=None):
+        raise NotImplementedError
+
+    def get_info(self, ticker):
+        raise NotImplementedError
+
+
+# Live Yahoo Finance backend (the loaders' original behaviour)
+class YFinanceProvider(MarketDataProvider):
+    name = 'yfinance'
+
+    def download_prices(self, tickers, period='1y', start=None):
+        tickers = list(tickers)
+        if start is None:
+            data = yf.download(tickers, period=period, group_by='ticker', auto_adjust=True, threads=False, progress=False)
+        else:
+            data = yf.download(tickers, start=start, group_by='ticker', auto_adjust=True, threads=False, progress=False)
+        frames = split_bulk_frame(data, tickers)
+        for ticker, frame in frames.items():
+            if frame.index.tz is not None:
+                frame.index = frame.index.tz_localize(None)
+            frames[ticker] = frame[PRICE_FIELDS]
+        return frames
+
+    def get_info(self, ticker):
+        return yf.Ticker(ticker).info
+
+
+# Business-day calendar from an anchor date up to a given day. Cached because
+# building a DatetimeIndex costs far more than generating the prices on it.
+@lru_cache(maxsize=8)
+def business_days(start, end):
+    return pd.bdate_range(start=start, end=end)
+
+# Deterministic generator backend: random-walk prices and fixed fundamentals
+# per ticker. Every call generates the same series from a fixed anchor date,
+# so overlapping windows agree and benchmarks are reproducible.
+class SyntheticProvider(MarketDataProvider):
+    name = 'synthetic'
+
+    def __init__(self, anchor_date='2015-01-01', seed=0):
+        self.anchor_date = anchor_date
+        self.seed = seed
+
+    def _rng(self, ticker):
+        return np.random.default_rng([zlib.crc32(ticker.encode()), self.seed])
+
+    def history(self, ticker):
+        dates = business_days(self.anchor_date, pd.to_datetime('today').normalize())
+        days = len(dates)
+        rng = self._rng(ticker)
+        close = rng.uniform(0.5, 5) * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+        open_ = close * (1 + rng.normal(0, 0.005, days))
+        return pd.DataFrame({
+            'Open': open_,
+            'High': np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, days)),
+            'Low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, days)),
+            'Close': close,
+            'Volume': rng.integers(1_000, 1_000_000, days),
+        }, index=dates)
+
+    def download_prices(self, tickers, period='1y', start=None):
+        frames = {}
+        for ticker in tickers:
+            frame = slice_window(self.history(ticker), period, start)
+            if not frame.empty:
+                frames[ticker] = frame
+        return frames
+
+    def get_info(self, ticker):
+        rng = self._rng(ticker)
+        revenue = float(rng.uniform(1e7, 5e9))
+        net_income = float(revenue * rng.uniform(-0.1, 0.25))
+        shares = float(rng.uniform(1e8, 5e9))
+        price = float(self.history(ticker)['Close'].iloc[-1])
+        eps = net_income / shares
+        return {
+            'longName': f"{ticker.split('.')[0]} Berhad",
+            'sector': None,
+            'marketCap': price * shares,
+            'trailingPE': price / eps if eps > 0 else None,
+            'totalRevenue': revenue,
+            'netIncomeToCommon': net_income,
+            'trailingEps': eps,
+        }
+
+
+# Record/replay backend. In replay mode responses are served from cassette
+# files under `directory` (prices/<ticker>.csv, info/<ticker>.json) and
+# nothing touches the network. In record mode every call goes to `upstream`
+# and the response is merged into the cassettes before being returned.
+class ReplayProvider(MarketDataProvider):
+    name = 'replay'
+
+    def __init__(self, directory, upstream=None, record=False):
+        if record and upstream is None:
+            raise ValueError("record mode needs an upstream provider")
+        self.directory = directory
+        self.upstream = upstream
+        self.record = record
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'prices'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'info'), exist_ok=True)
+
+    def _path(self, kind, ticker, extension):
+        return os.path.join(self.directory, kind, f"{ticker}.{extension}")
+
+    def _read_prices(self, ticker):
+        path = self._path('prices', ticker, 'csv')
+        if not os.path.exists(path):
+            return None
+        return pd.read_csv(path, index_col='Date', parse_dates=['Date'])
+
+    def _write_prices(self, ticker, frame):
+        with self.lock:
+            existing = self._read_prices(ticker)
+            if existing is not None:
+                frame = pd.concat([existing[~existing.index.isin(frame.index)], frame]).sort_index()
+            frame.rename_axis('Date').to_csv(self._path('prices', ticker, 'csv'))
+
+    def download_prices(self, tickers, period='1y', start=None):
+        if self.record:
+            frames = self.upstream.download_prices(tickers, period=period, start=start)
+            for ticker, frame in frames.items():
+                self._write_prices(ticker, frame)
+            return frames
+
+        frames = {}
+        for ticker in tickers:
+            frame = self._read_prices(ticker)
+            if frame is not None:
+                frame = slice_window(frame, period, start)
+                if not frame.empty:
+                    frames[ticker] = frame
+        return frames
+
+    def get_info(self, ticker):
+        path = self._path('info', ticker, 'json')
+        if self.record:
+            info = self.upstream.get_info(ticker)
+            with open(path, 'w') as f:
+                json.dump(info, f, default=str)
+            return info
+
+        if not os.path.exists(path):
+            raise KeyError(f"No recorded info for {ticker} in {self.directory}")
+        with open(path) as f:
+            return json.load(f)
+
+
+PROVIDERS = {
+    'yfinance': YFinanceProvider,
+    'synthetic': SyntheticProvider,
+}
+
+# Build a provider by name. 'replay' serves cassettes from cassette_dir;
+# record=True wraps the named provider and captures its responses there.
+def get_provider(name='yfinance', cassette_dir='cassettes', record=False):
+    if name == 'replay':
+        if record:
+            raise ValueError("cannot record from the replay provider")
+        return ReplayProvider(cassette_dir)
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {name}")
+    provider = PROVIDERS[name]()
+    if record:
+        return ReplayProvider(cassette_dir, upstream=provider, record=True)
+    return provider
+
+# Command-line options shared by the loaders
+def add_provider_arguments(parser):
+    parser.add_argument('--provider', choices=['yfinance', 'replay', 'synthetic'], default='yfinance',
+                        help="Market-data backend: live Yahoo Finance, recorded cassettes, or generated data")
+    parser.add_argument('--cassette-dir', default='cassettes', help="Directory holding recorded responses")
+    parser.add_argument('--record', action='store_true',
+                        help="Capture the provider's responses into --cassette-dir while loading")
+
+def provider_from_args(args):
+    return get_provider(args.provider, cassette_dir=args.cassette_dir, record=args.record)
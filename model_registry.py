@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import joblib
+
+# Persistent registry of fitted forecast models. Each model is stored once on
+# disk, keyed by (ticker, feature-set version, price version, hyperparameters),
+# compressed with joblib, and loaded lazily into a small in-memory LRU. The
+# price version is the generation in which the ticker's own prices last
+# changed (generation.get_price_version), so writes to other tickers or to
+# other tables keep its models valid. Saving a model deletes the same ticker's
+# models with the same hyperparameters from older price versions or older
+# feature sets.
+MODEL_DIR = 'models'
+MAX_LOADED_MODELS = 32
+COMPRESSION = 3
+
+# Short, stable digest of a hyperparameter dictionary
+def params_digest(params):
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+class ModelRegistry:
+    def __init__(self, directory=MODEL_DIR, max_loaded=MAX_LOADED_MODELS):
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _prefix(self, feature_version, params):
+        return f"f{feature_version}-{params_digest(params)}-g"
+
+    def path(self, ticker, feature_version, data_version, params):
+        return os.path.join(self.directory, ticker, f"{self._prefix(feature_version, params)}{data_version}.joblib")
+
+    def _remember(self, path, model):
+        with self.lock:
+            self.loaded[path] = model
+            self.loaded.move_to_end(path)
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+
+    # The stored model for this key, or None. Loads it from disk on first use.
+    def get(self, ticker, feature_version, data_version, params):
+        path = self.path(ticker, feature_version, data_version, params)
+        with self.lock:
+            if path in self.loaded:
+                self.loaded.move_to_end(path)
+                return self.loaded[path]
+        try:
+            model = joblib.load(path)
+        except FileNotFoundError:
+            return None
+        self._remember(path, model)
+        return model
+
+    # The stored model of the newest price version for this ticker, feature
+    # set and hyperparameters, or None
+    def latest(self, ticker, feature_version, params):
+        directory = os.path.join(self.directory, ticker)
+        prefix = self._prefix(feature_version, params)
+        versions = [int(name[len(prefix):-len('.joblib')])
+                    for name in (os.listdir(directory) if os.path.isdir(directory) else [])
+                    if name.startswith(prefix) and name.endswith('.joblib')
+                    and name[len(prefix):-len('.joblib')].isdigit()]
+        if not versions:
+            return None
+        return self.get(ticker, feature_version, max(versions), params)
+
+    # Store a model and drop older price versions of the same ticker, feature
+    # set and hyperparameters
+    def put(self, ticker, feature_version, data_version, params, model):
+        path = self.path(ticker, feature_version, data_version, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        joblib.dump(model, temporary_path, compress=COMPRESSION)
+        os.replace(temporary_path, path)
+        self._remember(path, model)
+        self.evict_stale(ticker, feature_version, data_version, params)
+        return path
+
+    # Return the stored model, fitting and storing it with fit() on a miss
+    def get_or_fit(self, ticker, feature_version, data_version, params, fit):
+        model = self.get(ticker, feature_version, data_version, params)
+        if model is None:
+            model = fit()
+            self.put(ticker, feature_version, data_version, params, model)
+        return model
+
+    # Delete models of older price versions, or older feature sets, for one
+    # ticker and set of hyperparameters. Returns the number of files removed.
+    def evict_stale(self, ticker, feature_version, data_version, params):
+        directory = os.path.join(self.directory, ticker)
+        digest = params_digest(params)
+        removed = 0
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            parts = name[:-len('.joblib')].split('-') if name.endswith('.joblib') else []
+            if len(parts) != 3 or parts[1] != digest or not (parts[0][1:].isdigit() and parts[2][1:].isdigit()):
+                continue
+            stored_version, stored_data_version = int(parts[0][1:]), int(parts[2][1:])
+            if stored_version < feature_version or (stored_version == feature_version
+                                                    and stored_data_version < data_version):
+                path = os.path.join(directory, name)
+                os.remove(path)
+                with self.lock:
+                    self.loaded.pop(path, None)
+                removed += 1
+        return removed
+
+_registry = None
+_registry_lock = threading.Lock()
+
+# The process-wide registry shared by every Streamlit session
+def get_model_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
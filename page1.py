@@ -26,6 +26,7 @@ def page1():
         1. **Overview**: 🏙️ View main market KLSE market trends and insights.
         2. **Sector Prediction**: 🏢 Analyze predictions for specific market sectors.
         3. **Company Prediction**: 🏦 Dive into detailed predictions for individual companies.
+        4. **Stock Screener**: 🔎 Filter and rank every stock by valuation, returns and risk.
         """
     )
 
@@ -1,7 +1,9 @@
 import pandas as pd
-import sqlite3
 import plotly.graph_objs as go
 import streamlit as st
+from db import read_sql
+from price_cube import get_price_cube
+from generation import current_generation
 
 # Helper: Define performance-to-color mapping
 def performance_to_color_scale(value):
@@ -18,23 +20,74 @@ def performance_to_color_scale(value):
     else:
         return 'darkred'  # decline more than 3%
 
-# Helper: Read holdings from the database
-def get_holdings_from_db():
-    db_path = 'klse_tickers.db'  # Path to your SQLite database
+# Helper: Build holdings for the latest trading day from the shared price cube
+# (one row per ticker that traded that day)
+def read_holdings():
+    latest = get_price_cube().day(columns=['open', 'close', 'volume'])
+    companies = read_sql("SELECT ticker, name, category FROM companies")
+    latest = latest.merge(companies, on='ticker')
+    return pd.DataFrame({
+        'Ticker': latest['ticker'],
+        'Sector': latest['category'],
+        'Company': latest['name'],
+        'Market Value': latest['close'] * latest['volume'],
+        'Daily Performance': (latest['close'] - latest['open']) / latest['open'] * 100,
+    })
+
+# Helper: Holdings for the latest trading day, cached per data generation
+@st.cache_data(show_spinner=False)
+def get_holdings_from_db(generation):
+    return read_holdings()
+
+# Helper: Date range covered by the sector rollups
+@st.cache_data(show_spinner=False)
+def get_sector_daily_range(generation):
+    data = read_sql("SELECT MIN(date) AS first, MAX(date) AS last FROM sector_daily")
+    if data.empty or data.iloc[0]['first'] is None:
+        return None, None
+    return pd.to_datetime(data.iloc[0]['first']).date(), pd.to_datetime(data.iloc[0]['last']).date()
+
+# Helper: Read the pre-aggregated daily sector rollups for a date range
+def read_sector_daily(start_date, end_date):
     query = """
-    SELECT sp.ticker AS Ticker, 
-           c.category AS Sector,
-           c.name AS Company, 
-           sp.close * sp.volume AS 'Market Value', 
-           ((sp.close - sp.open) / sp.open) * 100 AS 'Daily Performance'
-    FROM stock_prices sp
-    JOIN companies c ON sp.ticker = c.ticker
-    WHERE sp.date = (SELECT MAX(date) FROM stock_prices)
+    SELECT sector AS Sector,
+           date AS Date,
+           cap_weighted_return AS 'Return'
+    FROM sector_daily
+    WHERE date BETWEEN ? AND ?
+    ORDER BY sector, date
     """
-    with sqlite3.connect(db_path) as conn:
-        data = pd.read_sql(query, conn)
+    data = read_sql(query, params=(str(start_date), str(end_date)))
+    data['Date'] = pd.to_datetime(data['Date'])
     return data
 
+# Helper: Create the sector index chart (each sector rebased to 100 on the
+# first day of the range, compounding its cap-weighted daily returns)
+def create_sector_index_chart(sector_daily, sectors):
+    data = sector_daily[sector_daily['Sector'].isin(sectors)].copy()
+    data['Growth'] = 1 + data['Return'].fillna(0) / 100
+    data['Index'] = data.groupby('Sector')['Growth'].cumprod()
+    data['Index'] = 100 * data['Index'] / data.groupby('Sector')['Index'].transform('first')
+
+    fig = go.Figure()
+    for sector, sector_data in data.groupby('Sector'):
+        fig.add_trace(go.Scatter(
+            x=sector_data['Date'],
+            y=sector_data['Index'],
+            mode='lines',
+            name=sector
+        ))
+
+    fig.update_layout(
+        title="Sector Index (rebased to 100)",
+        xaxis_title="Date",
+        yaxis_title="Index",
+        hovermode="x unified",
+        margin=dict(t=25, l=25, r=25, b=25)
+    )
+
+    return fig
+
 # Helper: Create the heatmap for market capital
 def create_market_cap_heatmap(holdings):
     # Add color scale based on daily performance
@@ -144,6 +197,22 @@ def create_sector_performance_charts(holdings):
 
     return best_performers_chart, worst_performers_chart
 
+# Helper: Build the latest-day charts and heatmaps once per data generation
+# from the holdings the page already loaded (the leading underscore keeps
+# Streamlit from hashing the frame; the generation is the cache key)
+@st.cache_data(show_spinner=False)
+def get_holdings_figures(_holdings, generation):
+    holdings = _holdings.copy()
+    best_performers_chart, worst_performers_chart = create_sector_performance_charts(holdings)
+    market_cap_heatmap = create_market_cap_heatmap(holdings)
+    sector_sorted_heatmap = create_sector_based_heatmap(holdings)
+    return best_performers_chart, worst_performers_chart, market_cap_heatmap, sector_sorted_heatmap
+
+# Helper: Build the sector index chart once per data generation and selection
+@st.cache_data(show_spinner=False)
+def get_sector_index_chart(start_date, end_date, sectors, generation):
+    return create_sector_index_chart(read_sector_daily(start_date, end_date), sectors)
+
 # Streamlit page logic with added performance charts
 def page2():
     # Display the title with a larger font size and styling
@@ -153,8 +222,9 @@ def page2():
         market capitalization, and best/worst-performing sectors to make informed decisions.
     """)
 
-    # Load data from the database
-    holdings = get_holdings_from_db()
+    # Load data from the database (cached until a loader publishes new data)
+    generation = current_generation()
+    holdings = get_holdings_from_db(generation)
 
     if holdings.empty:
         st.write("No data available in the database.")
@@ -162,7 +232,8 @@ def page2():
 
     # Display a button to refresh the data (optional)
     if st.button("Refresh Data"):
-        holdings = get_holdings_from_db()
+        generation = current_generation()
+        holdings = get_holdings_from_db(generation)
 
     # Get top and worst performing sectors
     top_sectors, worst_sectors = get_top_and_worst_sectors(holdings)
@@ -179,7 +250,8 @@ def page2():
 
     # Create and display the performance charts for top 5 best and worst performing sectors
     st.subheader("Best and Worst Performing Sectors")
-    best_performers_chart, worst_performers_chart = create_sector_performance_charts(holdings)
+    best_performers_chart, worst_performers_chart, market_cap_heatmap, sector_sorted_heatmap = \
+        get_holdings_figures(holdings, generation)
     
     # Display both charts side by side
     col3, col4 = st.columns(2)
@@ -188,6 +260,20 @@ def page2():
     with col4:
         st.plotly_chart(worst_performers_chart)
 
+    # Sector index over a chosen date range, from the daily sector rollups
+    st.subheader("Sector Trends")
+    first_date, last_date = get_sector_daily_range(generation)
+    if first_date is None:
+        st.write("No sector history available yet.")
+    else:
+        default_start = max(first_date, (pd.Timestamp(last_date) - pd.DateOffset(years=1)).date())
+        date_range = st.date_input("Date range:", value=(default_start, last_date),
+                                   min_value=first_date, max_value=last_date)
+        sectors = st.multiselect("Sectors:", sorted(holdings['Sector'].dropna().unique()),
+                                 default=list(top_sectors['Sector']))
+        if len(date_range) == 2 and sectors:
+            st.plotly_chart(get_sector_index_chart(*date_range, sectors, generation))
+
     # Add description before heatmap for clarity
     st.subheader("How to Read the Heatmap")
     st.markdown("""
@@ -197,11 +283,8 @@ def page2():
         to the company's market value.
     """)
 
-    # Create the heatmap for market capital
+    # Show the heatmap for market capital
     st.subheader("Market Capitalization Heatmap")
-    market_cap_heatmap = create_market_cap_heatmap(holdings)
-
-    # Show the heatmap for market cap
     st.plotly_chart(market_cap_heatmap)
 
     # Add description before sector-based heatmap
@@ -212,11 +295,8 @@ def page2():
         Green sectors are performing well, while red sectors are underperforming.
     """)
 
-    # Create the sector-based heatmap
-    st.subheader("Sector-Based Heatmap")
-    sector_sorted_heatmap = create_sector_based_heatmap(holdings)
-
     # Show the sector-based heatmap
+    st.subheader("Sector-Based Heatmap")
     st.plotly_chart(sector_sorted_heatmap)
 
 # For testing in Streamlit
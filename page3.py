@@ -1,19 +1,26 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
-import time
-
-# Function to get a fresh database connection
+from db import get_read_connection
+from history import load_history
+from generation import current_generation, get_price_version
+from risk_engine import get_risk_score
+from forecasting import FORECAST_HORIZONS, get_forecaster
+from forecast_jobs import get_job_queue, submit_forecast
+from forecast_batch import get_forecast
+
+# Seconds between progress checks of a background forecast
+FORECAST_POLL_SECONDS = 0.5
+
+# Function to get this thread's pooled read-only database connection
 def get_db_connection():
-    return sqlite3.connect('klse_tickers.db', check_same_thread=False)
+    return get_read_connection()
 
-# Function to get categories from the database
-def get_categories():
+# Function to get categories from the database (the cached lookups below are
+# keyed on the data generation, so they refresh as soon as new data lands)
+@st.cache_data(show_spinner=False)
+def get_categories(generation):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT DISTINCT category FROM companies")
@@ -21,7 +28,8 @@ def get_categories():
     return categories
 
 # Function to get companies by category
-def get_companies_by_category(category):
+@st.cache_data(show_spinner=False)
+def get_companies_by_category(category, generation):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM companies WHERE category = ?", (category,))
@@ -29,72 +37,27 @@ def get_companies_by_category(category):
     return companies
 
 # Function to get company details from the financials table
-def get_company_details(company_name):
+@st.cache_data(show_spinner=False)
+def get_company_details(company_name, generation):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
             SELECT c.ticker, f.pe_ratio, f.market_cap, f.revenue, f.net_income, f.earnings_per_share
             FROM companies c
-            JOIN financials f ON c.ticker = f.ticker
+            JOIN financials f ON c.ticker = f.ticker AND f.valid_to IS NULL
             WHERE c.name = ?
-            ORDER BY f.date DESC LIMIT 1
+            LIMIT 1
             """,
             (company_name,),
         )
         company_details = cursor.fetchone()
     return company_details
 
-def get_stock_data_from_db(ticker):
-    # Fetch the stock data from the database
-    with get_db_connection() as conn:
-        query = f"SELECT * FROM stock_prices WHERE ticker = '{ticker}'"
-        stock_data = pd.read_sql(query, conn)
-
-    # Debugging: Check the first few rows of stock data after fetching it
-    print("Stock data sample:")
-    print(stock_data.head())
-    
-    # Debugging: Check if 'date' exists and its data type
-    if 'date' not in stock_data.columns:
-        raise KeyError("The 'date' column is missing from the stock data.")
-    print(f"'date' column type: {stock_data['date'].dtype}")
-    
-    return stock_data
-
-# Function to create features for the Random Forest model
-def create_features(data):
-    if 'date' not in data.columns:
-        raise KeyError("The 'date' column is missing in the data passed to create_features.")
-
-    # Convert 'date' to datetime
-    data['date'] = pd.to_datetime(data['date'], errors='coerce')
-
-    # Remove rows where 'date' could not be converted
-    data = data.dropna(subset=['date'])
-
-    # Set 'date' as the index
-    data.set_index('date', inplace=True)
-    data = data.resample('D').ffill()
-
-    # Create lag features
-    for i in range(1, 6):  # Lags for 1, 2, 3, 4, 5 days
-        data[f'lag_{i}'] = data['close'].shift(i)
-
-    # Create rolling mean features
-    data['rolling_mean_5'] = data['close'].rolling(window=5).mean()
-
-    # Drop rows with NaN values that were created during the shift
-    data.dropna(inplace=True)
-
-    # Drop 'ticker' column from the features since it's not numeric
-    data = data.drop('ticker', axis=1, errors='ignore')
-
-    # Create the feature matrix X and target vector y
-    X = data.drop('close', axis=1)  # Features should only include numerical columns
-    y = data['close']  # Target should be the stock price (close)
-
-    return X, y
+# Function to get a ticker's price history, optionally limited to a date
+# window and a subset of the price columns (cached per data generation)
+def get_stock_data_from_db(ticker, start=None, end=None, columns=None):
+    return load_history(ticker, start, end, columns)
 
 # Function to display today's and tomorrow's price with arrows
 def display_prices_and_arrows(today_price, tomorrow_price):
@@ -112,29 +75,6 @@ def display_prices_and_arrows(today_price, tomorrow_price):
         unsafe_allow_html=True
     )
 
-# Function to train Random Forest and make predictions
-def random_forest_forecast(data, forecast_range=7):
-    # Prepare the features and target
-    X, y = create_features(data)
-
-    # Train-test split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
-
-    # Initialize and train the Random Forest model
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
-
-    # Predict the next forecast_range days
-    forecast_data = X.tail(forecast_range)
-    forecast_predictions = model.predict(forecast_data)
-
-    # Calculate metrics
-    y_pred = model.predict(X_test)
-    mae = mean_absolute_error(y_test, y_pred)
-    r_squared = model.score(X_test, y_test)
-
-    return forecast_predictions, mae, r_squared
-
 def display_search_button(ticker):
     # Creating a Google search URL for the user to search for stock news
     search_url = f"https://www.google.com/search?q={ticker}+stock+news"
@@ -169,147 +109,41 @@ def display_search_button(ticker):
         <a class="search-button" href="{search_url}" target="_blank">Search for {ticker} Stock News</a>
         """, unsafe_allow_html=True)
 
-# Function to calculate volatility (standard deviation of daily returns)
-def calculate_volatility(ticker):
-    with get_db_connection() as conn:
-        query = """
-        SELECT date, open, close FROM stock_prices WHERE ticker = ? ORDER BY date DESC LIMIT 252
-        """
-        stock_data = pd.read_sql(query, conn, params=(ticker,))
-
-        # Calculate daily returns (percentage change)
-        stock_data['daily_return'] = stock_data['close'].pct_change()
-
-        # Calculate volatility (standard deviation of daily returns)
-        volatility = stock_data['daily_return'].std() * np.sqrt(252)  # Annualize the volatility
-
-    return volatility
-
-# Function to calculate revenue growth
-def calculate_revenue_growth(ticker):
+# Function to get a company's latest metrics next to its sector averages from
+# the sector_stats table maintained by the fundamentals loader
+@st.cache_data(show_spinner=False)
+def get_sector_relative_metrics(ticker, generation):
     with get_db_connection() as conn:
         query = """
-        SELECT date, revenue FROM financials WHERE ticker = ? ORDER BY date DESC LIMIT 2
+        SELECT s.metric, s.mean, f.market_cap, f.pe_ratio, f.revenue, f.net_income
+        FROM companies c
+        JOIN sector_stats s ON s.sector = c.category
+        JOIN financials f ON f.ticker = c.ticker AND f.valid_to IS NULL
+        WHERE c.ticker = ?
         """
-        revenue_data = pd.read_sql(query, conn, params=(ticker,))
-
-    if len(revenue_data) == 2:
-        revenue_growth = (
-            (revenue_data.iloc[0]['revenue'] - revenue_data.iloc[1]['revenue'])
-            / revenue_data.iloc[1]['revenue']
-        ) * 100
-        return revenue_growth
-    else:
-        return None  # Not enough data for revenue growth
-
-# Function to calculate profit margin
-def calculate_profit_margin(ticker):
-    with get_db_connection() as conn:
-        query = """
-        SELECT revenue, net_income FROM financials WHERE ticker = ? ORDER BY date DESC LIMIT 1
-        """
-        financial_data = pd.read_sql(query, conn, params=(ticker,))
-
-    if len(financial_data) > 0:
-        revenue = financial_data.iloc[0]['revenue']
-        net_income = financial_data.iloc[0]['net_income']
-
-        if revenue > 0:  # To avoid division by zero
-            return (net_income / revenue) * 100
-    return None
+        return pd.read_sql(query, conn, params=(ticker,))
 
 # Function to calculate normalized metrics by sector
 def normalize_by_sector(ticker):
-    with get_db_connection() as conn:
-        # Fetch the sector for the given ticker
-        query_sector = "SELECT category FROM companies WHERE ticker = ?"
-        sector = pd.read_sql(query_sector, conn, params=(ticker,)).iloc[0]['category']
-
-        # Fetch sector-wide metrics
-        query_sector_data = """
-        SELECT f.ticker, f.market_cap, f.pe_ratio, f.revenue, f.net_income
-        FROM financials f
-        JOIN companies c ON f.ticker = c.ticker
-        WHERE c.category = ?
-        """
-        sector_data = pd.read_sql(query_sector_data, conn, params=(sector,))
-
-        # Calculate sector averages
-        sector_avg = sector_data.mean(numeric_only=True)
+    metrics = get_sector_relative_metrics(ticker, current_generation())
 
-        # Fetch the target company's financial data
-        query_company = """
-        SELECT market_cap, pe_ratio, revenue, net_income
-        FROM financials
-        WHERE ticker = ? ORDER BY date DESC LIMIT 1
-        """
-        company_data = pd.read_sql(query_company, conn, params=(ticker,))
-
-    if company_data.empty or sector_data.empty:
+    if metrics.empty:
         return None  # Return None if data is insufficient
 
     # Normalize company metrics against sector averages
+    sector_avg = dict(zip(metrics['metric'], metrics['mean']))
+    company = metrics.iloc[0]
     normalized_metrics = {
-        'market_cap': company_data.iloc[0]['market_cap'] / sector_avg['market_cap'],
-        'pe_ratio': company_data.iloc[0]['pe_ratio'] / sector_avg['pe_ratio'],
-        'revenue': company_data.iloc[0]['revenue'] / sector_avg['revenue'],
-        'net_income': company_data.iloc[0]['net_income'] / sector_avg['net_income'],
+        metric: company[metric] / sector_avg[metric] if pd.notna(company[metric]) and sector_avg.get(metric) else None
+        for metric in ['market_cap', 'pe_ratio', 'revenue', 'net_income']
     }
 
     return normalized_metrics
 
-# Updated function to calculate the risk score
+# Function to look up the risk score computed by the batch risk engine
+# (risk_engine.py) after each ingestion run
 def calculate_risk(ticker):
-    with get_db_connection() as conn:
-        query = """
-        SELECT market_cap, pe_ratio FROM financials WHERE ticker = ? ORDER BY date DESC LIMIT 1
-        """
-        financial_data = pd.read_sql(query, conn, params=(ticker,))
-
-        if len(financial_data) > 0:
-            market_cap = financial_data.iloc[0]['market_cap']
-            pe_ratio = financial_data.iloc[0]['pe_ratio']
-
-            # Calculate metrics
-            volatility = calculate_volatility(ticker)
-            revenue_growth = calculate_revenue_growth(ticker)
-            profit_margin = calculate_profit_margin(ticker)
-
-            # Normalize metrics to 0-100 scale
-            risk_score = 0
-
-            # Volatility: Higher volatility = higher risk
-            if volatility and volatility < 0.1:
-                risk_score += 10
-            elif volatility and volatility < 0.2:
-                risk_score += 30
-            else:
-                risk_score += 50
-
-            # Revenue Growth: Negative growth = higher risk
-            if revenue_growth is not None:
-                if revenue_growth > 10:
-                    risk_score += 10  # Low risk
-                elif revenue_growth > 0:
-                    risk_score += 30  # Moderate risk
-                else:
-                    risk_score += 50  # High risk
-
-            # Profit Margin: Lower profit margin = higher risk
-            if profit_margin is not None:
-                if profit_margin > 15:
-                    risk_score += 10
-                elif profit_margin > 5:
-                    risk_score += 30
-                else:
-                    risk_score += 50
-
-            # Ensure risk score doesn't exceed 100
-            risk_score = min(risk_score, 100)
-
-            return risk_score
-
-    return None
+    return get_risk_score(get_db_connection(), ticker)
 
 
 # Display the risk for a selected company
@@ -345,19 +179,15 @@ def display_risk_for_selected_company(ticker):
             unsafe_allow_html=True
         )
 
-        # Animated progress bar
-        placeholder = st.empty()  # Create a placeholder for dynamic content
-
-        for i in range(risk_score + 1):
-            placeholder.markdown(
-                f"""
-                <div style="height: 15px; width: 100%; background-color: lightgrey; border-radius: 10px; overflow: hidden;">
-                    <div style="height: 100%; width: {i}%; background-color: {color};"></div>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
-            time.sleep(0.02)  # Adjust speed of the animation
+        # Risk bar
+        st.markdown(
+            f"""
+            <div style="height: 15px; width: 100%; background-color: lightgrey; border-radius: 10px; overflow: hidden;">
+                <div style="height: 100%; width: {risk_score}%; background-color: {color};"></div>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
 
         with st.expander("How is this calculated?"):
             st.markdown("""
@@ -374,7 +204,8 @@ def display_risk_for_selected_company(ticker):
             - Risk Score: $R = w_1 \\cdot \\sigma + w_2 \\cdot \\beta + w_3 \\cdot (1 - S) + w_4 \\cdot \\text{Sector Risk}$
             """)
 
-def get_all_companies():
+@st.cache_data(show_spinner=False)
+def get_all_companies(generation):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM companies")
@@ -396,23 +227,141 @@ def format_large_number(value):
     else:
         return f"{value:.2f}"
 
+# Function to display a forecast with today's price, the model details, the
+# risk analysis and the forecast chart
+def display_forecast(ticker, stock_data, forecast_range, forecast_predictions, mae, r_squared, forecast_method,
+                     forecast_source):
+    # Prepare forecast data (one point per coming trading day)
+    forecast_dates = pd.bdate_range(
+        start=stock_data['date'].max(), periods=forecast_range + 1
+    )[1:]
+    forecast_data = pd.DataFrame({'Date': forecast_dates, 'Predicted Price': forecast_predictions})
+
+    # Get today's price (last value from the historical data)
+    today_price = stock_data['close'].iloc[-1]
+
+    # Display today's price and tomorrow's forecast price with arrows
+    tomorrow_price = forecast_predictions[0]  # Forecast for the next day
+    display_prices_and_arrows(today_price, tomorrow_price)
+
+    # Display metrics in Streamlit with layman explanation
+    r_squared_percentage = r_squared * 100
+
+    with st.expander("Model Forecast Details", expanded=False):
+        st.markdown(
+            f"""
+            **Forecast Method:** {forecast_method}
+
+            **Forecast Source:** {forecast_source}
+
+            **Model Accuracy:** {r_squared_percentage:.2f}% | _This means the model explains {r_squared_percentage:.2f}% of the price movements based on historical data._
+
+            **Mean Absolute Error (MAE):** ±RM{mae:.2f} | _On average, the predictions deviate from actual prices by this amount._
+
+            **Note:** The forecast is based on historical trends and assumes market conditions remain stable.
+            """
+        )
+
+
+    display_risk_for_selected_company(ticker)
+
+    # Create Plotly figure
+    fig = go.Figure()
+
+    # Add historical price trace
+    fig.add_trace(go.Scatter(
+        x=stock_data['date'],
+        y=stock_data['close'],
+        mode='lines',
+        name='Historical Prices',
+        line=dict(color='blue')
+    ))
+
+    # Add forecasted price trace with color change based on price rise or fall
+    for i in range(1, len(forecast_predictions)):
+        color = 'green' if forecast_predictions[i] > forecast_predictions[i - 1] else 'red'
+        fig.add_trace(go.Scatter(
+            x=[forecast_dates[i - 1], forecast_dates[i]],
+            y=[forecast_predictions[i - 1], forecast_predictions[i]],
+            mode='lines',
+            name='Forecast Prices',
+            line=dict(color=color),
+            showlegend=False
+        ))
+
+    # Layout and styling for the plot
+    fig.update_layout(
+        title=f"Stock Price Forecast for {ticker}",
+        xaxis_title="Date",
+        yaxis_title="Price (RM)",
+        template="plotly_dark",
+        dragmode="pan",  # Enable drag-to-pan functionality
+        hovermode="x unified",  # Improve hover interaction
+    )
+
+    # Enable scroll zoom
+    fig.update_layout(
+        xaxis=dict(fixedrange=False),  # Allow zooming on x-axis
+        yaxis=dict(fixedrange=False),  # Allow zooming on y-axis
+    )
+
+    # Display forecast plot with interactivity
+    st.plotly_chart(fig, use_container_width=True, config={"scrollZoom": True})
+
+    display_search_button(ticker)
+
+# Function to poll a background forecast job without rerunning the whole
+# page; a full rerun renders the result once the job has finished
+@st.fragment(run_every=FORECAST_POLL_SECONDS)
+def display_forecast_progress(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    st.progress(job.progress, text=job.message)
+
+# Function to show the forecast for a ticker. Uses the nightly precomputed
+# forecast while it matches the ticker's current prices; otherwise a
+# background job (shared with every other session asking for the same
+# ticker) trains the model while the page shows its progress. With retry, a
+# failed job is run again.
+def show_forecast(ticker, stock_data, forecast_range, retry=False):
+    forecaster = get_forecaster()
+    data_version = get_price_version(get_db_connection(), ticker)
+    precomputed = get_forecast(get_db_connection(), ticker, forecast_range, data_version, forecaster.name)
+    if precomputed is not None:
+        forecast_predictions, mae, r_squared, computed_at = precomputed
+        display_forecast(ticker, stock_data, forecast_range, np.array(forecast_predictions), mae, r_squared,
+                         forecaster.label, f"Precomputed by the nightly forecast job ({computed_at})")
+        return
+
+    job = submit_forecast(ticker, data_version, forecaster, retry)
+    if job.status == 'failed':
+        st.error(f"An error occurred during forecasting: {job.error}")
+    elif job.status != 'done':
+        display_forecast_progress(job.id)
+    else:
+        forecast_predictions, mae, r_squared = job.result[forecast_range]
+        display_forecast(ticker, stock_data, forecast_range, forecast_predictions, mae, r_squared,
+                         forecaster.label, "Trained on demand")
+
 # Streamlit Application
 def page3():
     st.title("Stock Dashboard")
+    generation = current_generation()
 
     # Filter by category dropdown
-    category = st.selectbox("Filter by category:", ["All"] + get_categories())
+    category = st.selectbox("Filter by category:", ["All"] + get_categories(generation))
 
     # Display companies based on category or search term
     if category != "All":
-        companies = get_companies_by_category(category)
+        companies = get_companies_by_category(category, generation)
     else:
-        companies = get_all_companies()
+        companies = get_all_companies(generation)
     company_name = st.selectbox("Select a company:", companies)
 
     # If a company is selected, fetch and display details
+    company_details = get_company_details(company_name, generation) if company_name else None
     if company_name:
-        company_details = get_company_details(company_name)
         if company_details:
             ticker, pe_ratio, market_cap, revenue, net_income, eps = company_details
             st.subheader(f"Details for {company_name} ({ticker})")
@@ -468,28 +417,22 @@ def page3():
         else:
             st.warning("Company details not found.")
 
-    # Forecasting Section with Random Forest
+    # Forecasting Section
     st.title("Forecast for Selected Stock")
 
-    # Input for forecast range using select buttons
-    forecast_options = {
-        "1 week": 7,
-        "2 weeks": 14,
-        "3 weeks": 21,
-        "1 month": 30
-    }
+    # Input for forecast range using select buttons (in trading days)
+    forecast_options = dict(zip(["1 week", "2 weeks", "3 weeks", "1 month"], FORECAST_HORIZONS))
     forecast_range_label = st.selectbox(
         "Select forecast duration:",
         options=list(forecast_options.keys()),
         index=0  # Default selection is "1 week"
     )
 
-    # Map the selected label to its corresponding value in days
+    # Map the selected label to its corresponding value in trading days
     forecast_range = forecast_options[forecast_range_label]
 
     # Fetch stock data for the selected company
     if company_name:
-        company_details = get_company_details(company_name)
         if company_details:
             ticker = str(company_details[0])
             stock_data = get_stock_data_from_db(ticker)
@@ -505,88 +448,13 @@ def page3():
             if st.checkbox("Show raw data"):
                 st.dataframe(stock_data, height=500)
 
-            # Generate forecast data when button is pressed
-            if st.button("Generate Forecast"):
+            # Generate forecast data when button is pressed; the forecast then stays
+            # on the page for this company until another one is selected
+            clicked = st.button("Generate Forecast")
+            if clicked:
+                st.session_state['forecast_ticker'] = ticker
+            if st.session_state.get('forecast_ticker') == ticker:
                 try:
-                    forecast_predictions, mae, r_squared = random_forest_forecast(stock_data, forecast_range)
-
-                    # Prepare forecast data
-                    forecast_dates = pd.date_range(
-                        start=stock_data['date'].max(), periods=forecast_range + 1, freq='D'
-                    )[1:]
-                    forecast_data = pd.DataFrame({'Date': forecast_dates, 'Predicted Price': forecast_predictions})
-
-                    # Get today's price (last value from the historical data)
-                    today_price = stock_data['close'].iloc[-1]
-
-                    # Display today's price and tomorrow's forecast price with arrows
-                    tomorrow_price = forecast_predictions[0]  # Forecast for the next day
-                    display_prices_and_arrows(today_price, tomorrow_price)
-
-                    # Display metrics in Streamlit with layman explanation
-                    r_squared_percentage = r_squared * 100
-
-                    with st.expander("Model Forecast Details", expanded=False):
-                        st.markdown(
-                            f"""
-                            **Forecast Method:** Random Forest Regressor
-
-                            **Model Accuracy:** {r_squared_percentage:.2f}% | _This means the model explains {r_squared_percentage:.2f}% of the price movements based on historical data._
-
-                            **Mean Absolute Error (MAE):** ±RM{mae:.2f} | _On average, the predictions deviate from actual prices by this amount._
-
-                            **Note:** The forecast is based on historical trends and assumes market conditions remain stable.
-                            """
-                        )
-
-
-                    display_risk_for_selected_company(ticker)
-
-                    # Create Plotly figure
-                    fig = go.Figure()
-
-                    # Add historical price trace
-                    fig.add_trace(go.Scatter(
-                        x=stock_data['date'],
-                        y=stock_data['close'],
-                        mode='lines',
-                        name='Historical Prices',
-                        line=dict(color='blue')
-                    ))
-
-                    # Add forecasted price trace with color change based on price rise or fall
-                    for i in range(1, len(forecast_predictions)):
-                        color = 'green' if forecast_predictions[i] > forecast_predictions[i - 1] else 'red'
-                        fig.add_trace(go.Scatter(
-                            x=[forecast_dates[i - 1], forecast_dates[i]],
-                            y=[forecast_predictions[i - 1], forecast_predictions[i]],
-                            mode='lines',
-                            name='Forecast Prices',
-                            line=dict(color=color),
-                            showlegend=False
-                        ))
-
-                    # Layout and styling for the plot
-                    fig.update_layout(
-                        title=f"Stock Price Forecast for {ticker}",
-                        xaxis_title="Date",
-                        yaxis_title="Price (RM)",
-                        template="plotly_dark",
-                        dragmode="pan",  # Enable drag-to-pan functionality
-                        hovermode="x unified",  # Improve hover interaction
-                    )
-
-                    # Enable scroll zoom
-                    fig.update_layout(
-                        xaxis=dict(fixedrange=False),  # Allow zooming on x-axis
-                        yaxis=dict(fixedrange=False),  # Allow zooming on y-axis
-                    )
-
-                    # Display forecast plot with interactivity
-                    st.plotly_chart(fig, use_container_width=True, config={"scrollZoom": True})
-
+                    show_forecast(ticker, stock_data, forecast_range, retry=clicked)
                 except Exception as e:
                     st.error(f"An error occurred during forecasting: {e}")
-
-                display_search_button(ticker)
-
@@ -0,0 +1,124 @@
+import time
+import numpy as np
+import streamlit as st
+from db import get_read_connection
+from generation import current_generation
+from screener import load_screener_metrics, screen
+
+# Screener filters: column, label, and the multiplier between the stored
+# value and the value shown on the slider
+SLIDER_FILTERS = [
+    ('pe_ratio', "P/E Ratio", 1),
+    ('return_1m', "1M Return (%)", 1),
+    ('return_3m', "3M Return (%)", 1),
+    ('return_1y', "1Y Return (%)", 1),
+    ('volatility', "Annualized Volatility (%)", 100),
+    ('risk_score', "Risk Score", 1),
+]
+
+SORT_OPTIONS = {
+    "Market Cap": 'market_cap',
+    "P/E Ratio": 'pe_ratio',
+    "1M Return": 'return_1m',
+    "3M Return": 'return_3m',
+    "1Y Return": 'return_1y',
+    "Volatility": 'volatility',
+    "Average Volume": 'avg_volume',
+    "Risk Score": 'risk_score',
+}
+
+DISPLAY_COLUMNS = {
+    'ticker': "Ticker",
+    'name': "Company",
+    'sector': "Sector",
+    'close': "Close (RM)",
+    'market_cap': "Market Cap",
+    'pe_ratio': "P/E",
+    'return_1m': "1M %",
+    'return_3m': "3M %",
+    'return_1y': "1Y %",
+    'volatility': "Volatility",
+    'avg_volume': "Avg Volume",
+    'risk_score': "Risk",
+}
+
+# Function to load the precomputed screener table (cached per data generation)
+@st.cache_data(show_spinner=False)
+def get_screener_metrics(generation):
+    return load_screener_metrics(get_read_connection())
+
+# Function to show a range slider over the observed values of one column.
+# Returns (low, high) bounds, or (None, None) while the full range is selected
+# so tickers without a value are not filtered out.
+def range_filter(metrics, column, label, scale):
+    values = metrics[column].dropna().to_numpy(dtype=float) * scale
+    if len(values) == 0:
+        return None, None
+    low, high = float(np.floor(values.min())), float(np.ceil(values.max()))
+    if low == high:
+        return None, None
+    selected = st.slider(label, min_value=low, max_value=high, value=(low, high))
+    if selected == (low, high):
+        return None, None
+    return selected[0] / scale, selected[1] / scale
+
+# Streamlit Application
+def page4():
+    st.title("Stock Screener")
+    st.markdown("""
+        Filter and rank every KLSE stock at once by valuation, returns, volatility, volume and risk.
+        Metrics are refreshed after each data load.
+    """)
+
+    metrics = get_screener_metrics(current_generation())
+    if metrics.empty:
+        st.write("No data available in the database.")
+        return
+
+    bounds = {}
+    col1, col2 = st.columns(2)
+    with col1:
+        sectors = st.multiselect("Sectors:", sorted(metrics['sector'].dropna().unique()))
+        min_market_cap = st.number_input("Minimum Market Cap (RM millions):", min_value=0.0, value=0.0, step=100.0)
+        if min_market_cap > 0:
+            bounds['market_cap'] = (min_market_cap * 1e6, None)
+        min_volume = st.number_input("Minimum Average Daily Volume (20 days):", min_value=0.0, value=0.0, step=10000.0)
+        if min_volume > 0:
+            bounds['avg_volume'] = (min_volume, None)
+    with col2:
+        sort_label = st.selectbox("Sort by:", list(SORT_OPTIONS.keys()))
+        ascending = st.checkbox("Ascending", value=False)
+
+    with st.expander("Filters", expanded=True):
+        filter_columns = st.columns(2)
+        for index, (column, label, scale) in enumerate(SLIDER_FILTERS):
+            with filter_columns[index % 2]:
+                low, high = range_filter(metrics, column, label, scale)
+            if low is not None:
+                bounds[column] = (low, high)
+
+    start_time = time.perf_counter()
+    candidates = metrics[metrics['sector'].isin(sectors)] if sectors else metrics
+    results = screen(candidates, bounds, sort_by=SORT_OPTIONS[sort_label], ascending=ascending)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    st.caption(f"{len(results)} of {len(metrics)} stocks match ({elapsed_ms:.1f} ms)")
+    st.dataframe(
+        results[list(DISPLAY_COLUMNS)].rename(columns=DISPLAY_COLUMNS),
+        hide_index=True,
+        height=600,
+        column_config={
+            "Close (RM)": st.column_config.NumberColumn(format="%.3f"),
+            "Market Cap": st.column_config.NumberColumn(format="compact"),
+            "P/E": st.column_config.NumberColumn(format="%.2f"),
+            "1M %": st.column_config.NumberColumn(format="%.2f"),
+            "3M %": st.column_config.NumberColumn(format="%.2f"),
+            "1Y %": st.column_config.NumberColumn(format="%.2f"),
+            "Volatility": st.column_config.NumberColumn(format="percent"),
+            "Avg Volume": st.column_config.NumberColumn(format="compact"),
+        },
+    )
+
+# For testing in Streamlit
+if __name__ == "__main__":
+    page4()
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from db import get_read_connection
+from generation import current_generation
+
+# In-memory price cube: one contiguous (ticker id, trading-day id) NumPy array
+# per price field, built once per data generation and shared by every
+# Streamlit session in the process. Cells with no trading are NaN.
+CUBE_FIELDS = ['open', 'close', 'high', 'low', 'volume']
+
+class PriceCube:
+    def __init__(self, tickers, dates, fields, generation=0):
+        self.tickers = tickers
+        self.dates = dates
+        self.generation = generation
+        self.ticker_ids = {ticker: index for index, ticker in enumerate(tickers.tolist())}
+        # Shared between sessions, so nobody may modify them in place
+        for values in fields.values():
+            values.flags.writeable = False
+        self.fields = fields
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.fields.values())
+
+    def __contains__(self, ticker):
+        return ticker in self.ticker_ids
+
+    # Trading-day ids covering [start, end] (either end may be None)
+    def day_range(self, start=None, end=None):
+        first = 0 if start is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start), 'D'), 'left')
+        last = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end), 'D'), 'right')
+        return slice(first, last)
+
+    # One ticker's history in the shape of "SELECT * FROM stock_prices WHERE
+    # ticker = ?" (ticker, date, price columns), or None if it is not in the cube
+    def history(self, ticker, start=None, end=None, columns=None):
+        ticker_id = self.ticker_ids.get(ticker)
+        if ticker_id is None:
+            return None
+        days = self.day_range(start, end)
+        traded = ~np.isnan(self.fields['close'][ticker_id, days])
+
+        columns = CUBE_FIELDS if columns is None else [column for column in columns if column in CUBE_FIELDS]
+        data = {'ticker': ticker, 'date': self.dates[days][traded].astype('datetime64[ns]')}
+        for column in columns:
+            data[column] = self.fields[column][ticker_id, days][traded]
+        return pd.DataFrame(data)
+
+    # Every ticker that traded on one day (the latest day by default), one row
+    # per ticker with the requested price columns
+    def day(self, date=None, columns=None):
+        columns = CUBE_FIELDS if columns is None else [column for column in columns if column in CUBE_FIELDS]
+        days = self.day_range(date, date) if date is not None else slice(len(self.dates) - 1, len(self.dates))
+        if days.start >= days.stop:
+            return pd.DataFrame(columns=['ticker'] + columns)
+        day_id = days.start
+        traded = ~np.isnan(self.fields['close'][:, day_id])
+
+        data = {'ticker': self.tickers[traded]}
+        for column in columns:
+            data[column] = self.fields[column][traded, day_id]
+        return pd.DataFrame(data)
+
+# Build the cube from stock_prices in a single pass
+def build_price_cube(conn, generation=0):
+    rows = conn.execute("SELECT ticker, date, open, close, high, low, volume FROM stock_prices").fetchall()
+    if not rows:
+        empty = {field: np.empty((0, 0)) for field in CUBE_FIELDS}
+        return PriceCube(np.array([], dtype=str), np.array([], dtype='datetime64[D]'), empty, generation)
+
+    ticker_column, date_column, *value_columns = zip(*rows)
+    tickers, ticker_ids = np.unique(np.array(ticker_column, dtype=str), return_inverse=True)
+    dates, day_ids = np.unique(np.array(date_column, dtype='datetime64[D]'), return_inverse=True)
+
+    fields = {}
+    for field, values in zip(CUBE_FIELDS, value_columns):
+        cube = np.full((len(tickers), len(dates)), np.nan)
+        cube[ticker_ids, day_ids] = np.array(values, dtype=float)
+        fields[field] = cube
+    return PriceCube(tickers, dates, fields, generation)
+
+# Streamlit keeps one cube per process. A new data generation is a new cache
+# key, so the next caller builds the new cube while sessions still holding
+# the old one keep using it; max_entries=1 then drops the old one.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_price_cube(generation):
+    return build_price_cube(get_read_connection(), generation)
+
+# The shared cube for the current data generation
+def get_price_cube():
+    return _load_price_cube(current_generation())
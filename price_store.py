@@ -0,0 +1,126 @@
+import time
+from contextlib import contextmanager
+from itertools import groupby
+import pandas as pd
+from pandas.tseries.offsets import BDay
+from rollups import mark_sector_dates_dirty, refresh_latest_snapshot
+from generation import bump_data_generation, stamp_price_versions
+
+# Number of trading days re-fetched before each ticker's watermark so that
+# late corrections from the provider overwrite the rows we already have
+DEFAULT_OVERLAP_DAYS = 5
+
+# Get the high-water mark (latest stored date) for every ticker in stock_prices
+def get_price_watermarks(conn, tickers=None):
+    rows = conn.execute("SELECT ticker, MAX(date) FROM stock_prices GROUP BY ticker").fetchall()
+    watermarks = {ticker: pd.Timestamp(latest) for ticker, latest in rows if latest is not None}
+    if tickers is not None:
+        wanted = set(tickers)
+        watermarks = {ticker: latest for ticker, latest in watermarks.items() if ticker in wanted}
+    return watermarks
+
+# First date to fetch for a ticker, or None if it has no history yet
+def incremental_start_date(watermark, overlap_days=DEFAULT_OVERLAP_DAYS):
+    if watermark is None:
+        return None
+    return (pd.Timestamp(watermark) - BDay(overlap_days)).date()
+
+# Group tickers by the date their incremental fetch starts from, so that each
+# group can be downloaded with one multi-ticker request. Tickers without a
+# watermark are grouped under None and need a full-period download.
+def group_tickers_by_start_date(tickers, watermarks, overlap_days=DEFAULT_OVERLAP_DAYS):
+    groups = {}
+    for ticker in tickers:
+        start = incremental_start_date(watermarks.get(ticker), overlap_days)
+        groups.setdefault(start, []).append(ticker)
+    return groups
+
+# Provider columns in the order they are written to stock_prices
+PRICE_COLUMNS = ['Open', 'Close', 'High', 'Low', 'Volume']
+
+# Rows that already hold the same values are left untouched, so re-fetching
+# the overlap window only counts as a change where the provider corrected
+# something
+INSERT_PRICES_SQL = '''INSERT INTO stock_prices (ticker, date, open, close, high, low, volume)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)
+                         ON CONFLICT (ticker, date) DO UPDATE SET
+                             open = excluded.open, close = excluded.close, high = excluded.high,
+                             low = excluded.low, volume = excluded.volume
+                         WHERE open IS NOT excluded.open OR close IS NOT excluded.close
+                            OR high IS NOT excluded.high OR low IS NOT excluded.low
+                            OR volume IS NOT excluded.volume'''
+
+# Tune the connection for a bulk load, restoring the per-connection settings
+# afterwards. WAL is persistent and also lets the dashboard read during loads.
+@contextmanager
+def bulk_load_pragmas(conn, cache_size_kib=65536):
+    conn.commit()
+    previous_synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    previous_cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{cache_size_kib}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    try:
+        yield conn
+    finally:
+        conn.commit()
+        conn.execute(f"PRAGMA synchronous={previous_synchronous}")
+        conn.execute(f"PRAGMA cache_size={previous_cache_size}")
+
+# Convert a batch of {ticker: frame} into column arrays and zip them into
+# insert rows. The frames are concatenated first so each column is converted
+# once per batch; dates go through NumPy because pandas' strftime is slow.
+def frames_to_rows(frames):
+    frames = {ticker: frame for ticker, frame in frames.items() if not frame.empty}
+    if not frames:
+        return []
+
+    combined = pd.concat(frames, names=['ticker', 'date'])
+    dates = combined.index.get_level_values('date')
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    tickers = combined.index.get_level_values('ticker').tolist()
+    dates = dates.to_numpy(dtype='datetime64[D]').astype(str).tolist()
+    columns = [combined[column].to_numpy(dtype=float).tolist() for column in PRICE_COLUMNS]
+    return list(zip(tickers, dates, *columns))
+
+# Write a batch of {ticker: frame} into stock_prices with executemany inside a
+# single transaction. For the tickers whose rows actually changed it refreshes
+# their latest_snapshot rows, queues the written dates for the sector rollups
+# (refreshed once per run by the loader), publishes a new data generation and
+# stamps their price versions with it. Returns the number of rows written.
+def write_price_frames(conn, frames):
+    rows = frames_to_rows(frames)
+    if rows:
+        with conn:
+            changed, dates = [], set()
+            for ticker, ticker_rows in groupby(rows, key=lambda row: row[0]):
+                ticker_rows = list(ticker_rows)
+                before = conn.total_changes
+                conn.executemany(INSERT_PRICES_SQL, ticker_rows)
+                if conn.total_changes > before:
+                    changed.append(ticker)
+                    dates.update(row[1] for row in ticker_rows)
+            if changed:
+                refresh_latest_snapshot(conn, changed)
+                mark_sector_dates_dirty(conn, dates)
+                stamp_price_versions(conn, changed, bump_data_generation(conn))
+    return len(rows)
+
+# Running totals for a load so the loaders can report write throughput
+class WriteStats:
+    def __init__(self):
+        self.rows = 0
+        self.seconds = 0.0
+
+    def write(self, conn, frames):
+        start_time = time.perf_counter()
+        rows = write_price_frames(conn, frames)
+        self.seconds += time.perf_counter() - start_time
+        self.rows += rows
+        return rows
+
+    def report(self):
+        rate = self.rows / self.seconds if self.seconds > 0 else 0.0
+        return f"Wrote {self.rows} rows in {self.seconds:.2f}s ({rate:,.0f} rows/s)"
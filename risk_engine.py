@@ -0,0 +1,165 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+# Batch risk engine: volatility, revenue growth, profit margin and the
+# combined 0-100 risk score for every ticker at once, written to the
+# risk_scores table after each ingestion run. The dashboard only looks the
+# scores up. Like the rollups, refresh_risk_scores does not commit.
+
+# Trading days of closes used for the annualized volatility
+VOLATILITY_WINDOW = 252
+
+# Last VOLATILITY_WINDOW closes of every ticker, newest first
+RECENT_CLOSES = f'''
+    SELECT ticker, close FROM (
+        SELECT ticker, close, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY date DESC) AS age
+        FROM stock_prices
+    ) WHERE age <= {VOLATILITY_WINDOW}
+    ORDER BY ticker, age
+'''
+
+# Latest two financials versions of every ticker, newest first
+RECENT_FINANCIALS = '''
+    SELECT ticker, revenue, net_income FROM (
+        SELECT ticker, revenue, net_income, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY valid_from DESC) AS age
+        FROM financials
+    ) WHERE age <= 2
+    ORDER BY ticker, age
+'''
+
+# Spread rows of (ticker, value...) sorted by ticker and age into a
+# (ticker, age) matrix per value column, padded with NaN. Returns the
+# tickers, their row counts and the matrices.
+def to_age_matrices(rows, width):
+    tickers, *columns = zip(*rows)
+    tickers = np.array(tickers, dtype=str)
+    unique, starts, counts = np.unique(tickers, return_index=True, return_counts=True)
+    age = np.arange(len(tickers)) - np.repeat(starts, counts)
+    row = np.repeat(np.arange(len(unique)), counts)
+
+    matrices = []
+    for values in columns:
+        matrix = np.full((len(unique), width), np.nan)
+        matrix[row, age] = np.array(values, dtype=float)
+        matrices.append(matrix)
+    return unique, counts, matrices
+
+# Reorder per-ticker values from the sorted `source_tickers` to `tickers`,
+# with NaN for tickers that have no value
+def align_rows(tickers, source_tickers, values):
+    aligned = np.full(len(tickers), np.nan)
+    if len(source_tickers) == 0:
+        return aligned
+    positions = np.minimum(np.searchsorted(source_tickers, tickers), len(source_tickers) - 1)
+    found = source_tickers[positions] == tickers
+    aligned[found] = values[positions[found]]
+    return aligned
+
+# Annualized standard deviation of daily returns, one value per row of a
+# (ticker, age) close matrix with the newest close first
+def annualized_volatility(closes):
+    closes = closes[:, ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = closes[:, 1:] / closes[:, :-1] - 1
+        counts = np.sum(~np.isnan(returns), axis=1)
+        means = np.nansum(returns, axis=1) / counts
+        variance = np.nansum((returns - means[:, None]) ** 2, axis=1) / (counts - 1)
+    return np.where(counts > 1, np.sqrt(variance) * np.sqrt(252), np.nan)
+
+# Bucket a metric into risk points: below/above the two thresholds gives
+# 10, 30 or 50 points. Missing values score `missing` points.
+def _points(values, low, high, higher_is_riskier, missing):
+    if higher_is_riskier:
+        points = np.select([values < low, values < high], [10, 30], 50)
+    else:
+        points = np.select([values > high, values > low], [10, 30], 50)
+    return np.where(np.isnan(values), missing, points)
+
+# Compute the risk metrics of every ticker that has financials. Returns a
+# DataFrame with ticker, volatility, revenue_growth, profit_margin, risk_score.
+def compute_risk_scores(conn):
+    financial_rows = conn.execute(RECENT_FINANCIALS).fetchall()
+    if not financial_rows:
+        return pd.DataFrame(columns=['ticker', 'volatility', 'revenue_growth', 'profit_margin', 'risk_score'])
+    tickers, counts, (revenue, net_income) = to_age_matrices(financial_rows, 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        revenue_growth = (revenue[:, 0] - revenue[:, 1]) / revenue[:, 1] * 100
+        profit_margin = np.where(revenue[:, 0] > 0, net_income[:, 0] / revenue[:, 0] * 100, np.nan)
+    # Growth needs two rows; a zero previous revenue counts as high risk
+    has_growth = counts == 2
+    revenue_growth[~np.isfinite(revenue_growth)] = np.nan
+
+    volatility = np.full(len(tickers), np.nan)
+    price_rows = conn.execute(RECENT_CLOSES).fetchall()
+    if price_rows:
+        price_tickers, _, (closes,) = to_age_matrices(price_rows, VOLATILITY_WINDOW)
+        volatility = align_rows(tickers, price_tickers, annualized_volatility(closes))
+
+    # Volatility: higher volatility = higher risk (missing or zero counts as high)
+    score = _points(np.where(volatility == 0, np.nan, volatility), 0.1, 0.2, True, 50)
+    # Revenue growth: negative growth = higher risk (no score without two rows)
+    score += np.where(has_growth, _points(revenue_growth, 0, 10, False, 50), 0)
+    # Profit margin: lower margin = higher risk (no score without positive revenue)
+    score += np.where(revenue[:, 0] > 0, _points(profit_margin, 5, 15, False, 50), 0)
+
+    return pd.DataFrame({
+        'ticker': tickers,
+        'volatility': volatility,
+        'revenue_growth': np.where(has_growth, revenue_growth, np.nan),
+        'profit_margin': profit_margin,
+        'risk_score': np.minimum(score, 100),
+    })
+
+# Recompute and replace every row of risk_scores. Returns the number of
+# tickers scored.
+def refresh_risk_scores(conn):
+    scores = compute_risk_scores(conn)
+    conn.execute("DELETE FROM risk_scores")
+    conn.executemany('''INSERT INTO risk_scores (ticker, volatility, revenue_growth, profit_margin, risk_score)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     [(ticker, None if np.isnan(volatility) else volatility,
+                       None if np.isnan(growth) else growth,
+                       None if np.isnan(margin) else margin, int(score))
+                      for ticker, volatility, growth, margin, score in scores.itertuples(index=False)])
+    return len(scores)
+
+# Look up one ticker's risk score, or None if it has not been scored
+def get_risk_score(conn, ticker):
+    row = conn.execute("SELECT risk_score FROM risk_scores WHERE ticker = ?", (ticker,)).fetchone()
+    return row[0] if row else None
+
+# The whole market ranked by risk score (lowest risk first by default)
+def rank_by_risk(conn, ascending=True, limit=None):
+    query = f'''SELECT r.ticker, c.name, c.category, r.risk_score, r.volatility, r.revenue_growth, r.profit_margin
+                FROM risk_scores r
+                JOIN companies c ON c.ticker = r.ticker
+                ORDER BY r.risk_score {'ASC' if ascending else 'DESC'}, r.ticker'''
+    params = ()
+    if limit is not None:
+        query += " LIMIT ?"
+        params = (limit,)
+    return pd.read_sql(query, conn, params=params)
+
+# Command-line entry point: refresh the scores and print the ranking
+if __name__ == "__main__":
+    from db import open_write_connection
+    from generation import bump_data_generation
+    from screener import refresh_screener_metrics
+
+    parser = argparse.ArgumentParser(description="Recompute risk scores for every ticker and print the ranking.")
+    parser.add_argument('--top', type=int, default=20, help="Number of tickers to print")
+    parser.add_argument('--riskiest', action='store_true', help="Print the highest risk tickers first")
+    args = parser.parse_args()
+
+    conn = open_write_connection()
+    try:
+        with conn:
+            scored = refresh_risk_scores(conn)
+            refresh_screener_metrics(conn)
+            bump_data_generation(conn)
+        print(f"Scored {scored} tickers")
+        print(rank_by_risk(conn, ascending=not args.riskiest, limit=args.top).to_string(index=False))
+    finally:
+        conn.close()
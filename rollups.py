@@ -0,0 +1,155 @@
+import pandas as pd
+
+# Derived tables maintained by ingestion so the dashboard never has to
+# aggregate the full price history or every fundamentals snapshot. These functions do not commit; they run
+# inside the caller's write transaction so the rollups always match the data.
+
+# Latest price row per ticker, joined with its company details
+LATEST_SNAPSHOT_SELECT = '''
+    SELECT sp.ticker, c.category, c.name, sp.date, sp.close, sp.open, sp.volume,
+           sp.close * sp.volume,
+           ((sp.close - sp.open) / sp.open) * 100
+    FROM stock_prices sp
+    JOIN companies c ON sp.ticker = c.ticker
+'''
+
+LATEST_SNAPSHOT_INSERT = '''INSERT OR REPLACE INTO latest_snapshot
+                                (ticker, sector, company, date, close, open, volume, market_value, daily_performance)'''
+
+# Rebuild the latest_snapshot rows of the given tickers (or every ticker)
+def refresh_latest_snapshot(conn, tickers=None):
+    if tickers is None:
+        conn.execute("DELETE FROM latest_snapshot")
+        conn.execute(f'''{LATEST_SNAPSHOT_INSERT}
+                         {LATEST_SNAPSHOT_SELECT}
+                         JOIN (SELECT ticker, MAX(date) AS date FROM stock_prices GROUP BY ticker) latest
+                           ON latest.ticker = sp.ticker AND latest.date = sp.date''')
+        return
+
+    conn.executemany(f'''{LATEST_SNAPSHOT_INSERT}
+                         {LATEST_SNAPSHOT_SELECT}
+                         WHERE sp.ticker = ?
+                           AND sp.date = (SELECT MAX(date) FROM stock_prices WHERE ticker = ?)''',
+                     [(ticker, ticker) for ticker in tickers])
+
+# Shares outstanding of every ticker, estimated from its current market cap
+# and its close on the day that market cap was fetched (or the first close
+# after it, for fundamentals loaded before any prices)
+SHARES_OUTSTANDING = '''
+    SELECT f.ticker,
+           f.market_cap / COALESCE(
+               (SELECT p.close FROM stock_prices p WHERE p.ticker = f.ticker AND p.date <= f.valid_from
+                ORDER BY p.date DESC LIMIT 1),
+               (SELECT p.close FROM stock_prices p WHERE p.ticker = f.ticker AND p.date > f.valid_from
+                ORDER BY p.date LIMIT 1)) AS shares
+    FROM financials f
+    WHERE f.valid_to IS NULL AND f.market_cap > 0
+'''
+
+# Per-sector aggregates for one trading day from per-ticker close-to-close
+# returns (in %) and market values (close * volume, as on the heatmaps). The
+# cap-weighted return weights each return by the ticker's market cap at the
+# previous close (shares outstanding * previous close); tickers without a
+# market cap are left out of it. The shares are materialized once per
+# statement rather than looked up for every price row.
+SECTOR_DAILY_INSERT = '''
+    WITH s AS MATERIALIZED ({shares})
+    INSERT OR REPLACE INTO sector_daily
+        (sector, date, tickers, market_value, mean_return, cap_weighted_return, advancers, decliners)
+    SELECT c.category, r.date, COUNT(*), SUM(r.market_value), AVG(r.ret),
+           SUM(r.ret * s.shares * r.previous_close)
+               / SUM(CASE WHEN r.ret IS NOT NULL THEN s.shares * r.previous_close END),
+           SUM(r.ret > 0), SUM(r.ret < 0)
+    FROM (SELECT *, (close / previous_close - 1) * 100 AS ret FROM ({returns})) r
+    JOIN companies c ON c.ticker = r.ticker
+    LEFT JOIN s ON s.ticker = r.ticker
+    GROUP BY c.category, r.date
+'''
+
+# Closes for a single date; the previous close comes from an index seek
+RETURNS_FOR_DATE = '''
+    SELECT sp.ticker, sp.date, sp.close, sp.close * sp.volume AS market_value,
+           (SELECT p.close FROM stock_prices p
+            WHERE p.ticker = sp.ticker AND p.date < sp.date
+            ORDER BY p.date DESC LIMIT 1) AS previous_close
+    FROM stock_prices sp
+    WHERE sp.date = ?
+'''
+
+# Closes for every row in one pass over the primary key
+RETURNS_FOR_ALL_DATES = '''
+    SELECT ticker, date, close, close * volume AS market_value,
+           LAG(close) OVER (PARTITION BY ticker ORDER BY date) AS previous_close
+    FROM stock_prices
+'''
+
+# Queue trading days whose sector rollups must be recomputed
+def mark_sector_dates_dirty(conn, dates):
+    conn.executemany("INSERT OR IGNORE INTO sector_daily_pending (date) VALUES (?)", [(date,) for date in dates])
+
+# Past this many queued days a single full rebuild is cheaper than per-day updates
+FULL_REBUILD_PENDING_DAYS = 60
+
+# Recompute sector_daily for the queued trading days only (or rebuild every
+# day with full=True). Returns the number of days recomputed.
+def refresh_sector_daily(conn, full=False):
+    if not full:
+        pending = conn.execute("SELECT COUNT(*) FROM sector_daily_pending").fetchone()[0]
+        full = pending > FULL_REBUILD_PENDING_DAYS
+
+    if full:
+        conn.execute("DELETE FROM sector_daily")
+        conn.execute(SECTOR_DAILY_INSERT.format(returns=RETURNS_FOR_ALL_DATES, shares=SHARES_OUTSTANDING))
+        conn.execute("DELETE FROM sector_daily_pending")
+        return conn.execute("SELECT COUNT(DISTINCT date) FROM sector_daily").fetchone()[0]
+
+    dates = [row[0] for row in conn.execute("SELECT date FROM sector_daily_pending ORDER BY date")]
+    for date in dates:
+        conn.execute("DELETE FROM sector_daily WHERE date = ?", (date,))
+        conn.execute(SECTOR_DAILY_INSERT.format(returns=RETURNS_FOR_DATE, shares=SHARES_OUTSTANDING), (date,))
+    conn.execute("DELETE FROM sector_daily_pending")
+    return len(dates)
+
+def rebuild_sector_daily(conn):
+    refresh_sector_daily(conn, full=True)
+
+# Fundamentals summarised per sector for sector-relative metrics
+SECTOR_STATS_METRICS = ['market_cap', 'pe_ratio', 'revenue', 'net_income']
+
+# Current financials version of every company, with its sector
+LATEST_SECTOR_FINANCIALS = '''
+    SELECT c.category AS sector, f.market_cap, f.pe_ratio, f.revenue, f.net_income
+    FROM companies c
+    JOIN financials f ON f.ticker = c.ticker AND f.valid_to IS NULL
+'''
+
+# Recompute sector_stats (count, mean, median and 10/25/75/90th percentiles
+# of each metric over the current version per ticker) for the sectors of the given
+# tickers, or for every sector. Returns the number of sectors recomputed.
+def refresh_sector_stats(conn, tickers=None):
+    query, params = LATEST_SECTOR_FINANCIALS, []
+    if tickers is not None:
+        tickers = list(tickers)
+        sectors = {row[0] for row in conn.execute(
+            f"SELECT DISTINCT category FROM companies WHERE ticker IN ({','.join('?' * len(tickers))})", tickers)}
+        if not sectors:
+            return 0
+        query += f" WHERE c.category IN ({','.join('?' * len(sectors))})"
+        params = list(sectors)
+        conn.executemany("DELETE FROM sector_stats WHERE sector = ?", [(sector,) for sector in sectors])
+    else:
+        conn.execute("DELETE FROM sector_stats")
+
+    latest = pd.read_sql(query, conn, params=params)
+    rows = []
+    for sector, group in latest.groupby('sector'):
+        for metric in SECTOR_STATS_METRICS:
+            values = group[metric].dropna()
+            if values.empty:
+                continue
+            p10, p25, p75, p90 = values.quantile([0.1, 0.25, 0.75, 0.9])
+            rows.append((sector, metric, len(values), values.mean(), values.median(), p10, p25, p75, p90))
+    conn.executemany('''INSERT OR REPLACE INTO sector_stats
+                            (sector, metric, tickers, mean, median, p10, p25, p75, p90)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    return latest['sector'].nunique()
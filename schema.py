@@ -0,0 +1,358 @@
+import argparse
+import sys
+from db import open_write_connection
+from rollups import rebuild_sector_daily, refresh_latest_snapshot, refresh_sector_stats
+from generation import bump_data_generation
+from risk_engine import refresh_risk_scores
+from fundamentals import collapse_financials_history
+from screener import refresh_screener_metrics
+
+# Versioned schema migrations. The applied version is kept in SQLite's
+# PRAGMA user_version; each migration runs once, in order, in its own
+# transaction. Add new schema changes as a new entry at the end.
+MIGRATIONS = [
+    (1, "Base tables", [
+        '''CREATE TABLE IF NOT EXISTS companies (
+               ticker TEXT PRIMARY KEY,
+               name TEXT NOT NULL,
+               category TEXT
+           )''',
+        '''CREATE TABLE IF NOT EXISTS financials (
+               ticker TEXT,
+               date DATE,
+               market_cap REAL,
+               pe_ratio REAL,
+               revenue REAL,
+               net_income REAL,
+               earnings_per_share REAL,
+               PRIMARY KEY (ticker, date),
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        '''CREATE TABLE IF NOT EXISTS stock_prices (
+               ticker TEXT,
+               date DATE,
+               open REAL,
+               close REAL,
+               high REAL,
+               low REAL,
+               volume INTEGER,
+               PRIMARY KEY (ticker, date),
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        '''CREATE TABLE IF NOT EXISTS userstable (
+               username TEXT PRIMARY KEY,
+               password TEXT
+           )''',
+        '''CREATE TABLE IF NOT EXISTS ingestion_runs (
+               run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               job TEXT NOT NULL,
+               status TEXT NOT NULL,
+               started_at TEXT NOT NULL,
+               finished_at TEXT
+           )''',
+        '''CREATE TABLE IF NOT EXISTS ingestion_journal (
+               run_id INTEGER NOT NULL,
+               ticker TEXT NOT NULL,
+               status TEXT NOT NULL,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               last_error TEXT,
+               rows_written INTEGER NOT NULL DEFAULT 0,
+               updated_at TEXT,
+               PRIMARY KEY (run_id, ticker),
+               FOREIGN KEY (run_id) REFERENCES ingestion_runs(run_id)
+           )''',
+    ]),
+    (2, "Replace the ad-hoc indexes with ones matched to the dashboard queries", [
+        # Duplicates of the (ticker) primary key / (ticker, date) primary key prefix
+        "DROP INDEX IF EXISTS idx_ticker_companies",
+        "DROP INDEX IF EXISTS idx_ticker_prices",
+        # Superseded by the covering (category, name) index below
+        "DROP INDEX IF EXISTS idx_category",
+        "DROP INDEX IF EXISTS idx_name",
+        # Companies by category (page3 dropdown) and the distinct category list
+        "CREATE INDEX IF NOT EXISTS idx_companies_category_name ON companies (category, name)",
+        # Company lookups by display name (get_company_details)
+        "CREATE INDEX IF NOT EXISTS idx_companies_name ON companies (name, ticker)",
+        # Latest trading day (MAX(date)) and all rows of one day (page2 holdings)
+        "CREATE INDEX IF NOT EXISTS idx_date_prices ON stock_prices (date)",
+        # Run lookups by job (resume / retry-failed)
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_runs_job ON ingestion_runs (job, status)",
+    ]),
+    (3, "Materialized latest price snapshot for the Sector Prediction page", [
+        '''CREATE TABLE IF NOT EXISTS latest_snapshot (
+               ticker TEXT PRIMARY KEY,
+               sector TEXT,
+               company TEXT,
+               date DATE,
+               close REAL,
+               open REAL,
+               volume INTEGER,
+               market_value REAL,
+               daily_performance REAL,
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        "CREATE INDEX IF NOT EXISTS idx_latest_snapshot_date ON latest_snapshot (date)",
+        refresh_latest_snapshot,
+    ]),
+    (4, "Per-sector daily rollups for the sector index charts", [
+        '''CREATE TABLE IF NOT EXISTS sector_daily (
+               sector TEXT,
+               date DATE,
+               tickers INTEGER,
+               market_value REAL,
+               mean_return REAL,
+               cap_weighted_return REAL,
+               advancers INTEGER,
+               decliners INTEGER,
+               PRIMARY KEY (sector, date)
+           )''',
+        "CREATE INDEX IF NOT EXISTS idx_sector_daily_date ON sector_daily (date)",
+        # Trading days written since the rollups were last refreshed
+        "CREATE TABLE IF NOT EXISTS sector_daily_pending (date DATE PRIMARY KEY)",
+        # Backfilled by migration 12, which needs the financials layout of migration 8
+    ]),
+    (5, "Metadata table holding the data generation counter", [
+        '''CREATE TABLE IF NOT EXISTS metadata (
+               key TEXT PRIMARY KEY,
+               value INTEGER NOT NULL
+           )''',
+        bump_data_generation,
+    ]),
+    (6, "Risk scores computed for every ticker by the batch risk engine", [
+        '''CREATE TABLE IF NOT EXISTS risk_scores (
+               ticker TEXT PRIMARY KEY,
+               volatility REAL,
+               revenue_growth REAL,
+               profit_margin REAL,
+               risk_score INTEGER NOT NULL,
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        # Market-wide risk ranking
+        "CREATE INDEX IF NOT EXISTS idx_risk_scores_score ON risk_scores (risk_score, ticker)",
+        # Backfilled by migration 8, which changes the financials layout
+    ]),
+    (7, "Per-sector fundamentals statistics for sector-relative metrics", [
+        '''CREATE TABLE IF NOT EXISTS sector_stats (
+               sector TEXT,
+               metric TEXT,
+               tickers INTEGER,
+               mean REAL,
+               median REAL,
+               p10 REAL,
+               p25 REAL,
+               p75 REAL,
+               p90 REAL,
+               PRIMARY KEY (sector, metric)
+           )''',
+        # Backfilled by migration 8, which changes the financials layout
+    ]),
+    (8, "Change-only financials with valid_from/valid_to ranges", [
+        '''CREATE TABLE financials_versions (
+               ticker TEXT,
+               valid_from DATE,
+               valid_to DATE,
+               market_cap REAL,
+               pe_ratio REAL,
+               revenue REAL,
+               net_income REAL,
+               earnings_per_share REAL,
+               PRIMARY KEY (ticker, valid_from),
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        collapse_financials_history,
+        "DROP TABLE financials",
+        "ALTER TABLE financials_versions RENAME TO financials",
+        # Current version of every ticker (latest-value lookups and sector stats)
+        "CREATE INDEX IF NOT EXISTS idx_financials_current ON financials (ticker) WHERE valid_to IS NULL",
+        refresh_risk_scores,
+        refresh_sector_stats,
+    ]),
+    (9, "Precomputed per-ticker metrics for the stock screener", [
+        '''CREATE TABLE IF NOT EXISTS screener_metrics (
+               ticker TEXT PRIMARY KEY,
+               name TEXT,
+               sector TEXT,
+               close REAL,
+               market_cap REAL,
+               pe_ratio REAL,
+               return_1m REAL,
+               return_3m REAL,
+               return_1y REAL,
+               volatility REAL,
+               avg_volume REAL,
+               risk_score INTEGER,
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        refresh_screener_metrics,
+    ]),
+    (10, "Precomputed forecasts from the nightly batch job", [
+        '''CREATE TABLE IF NOT EXISTS forecasts (
+               ticker TEXT,
+               horizon INTEGER,
+               generation INTEGER NOT NULL,
+               feature_version INTEGER NOT NULL,
+               predictions TEXT NOT NULL,
+               mae REAL,
+               r_squared REAL,
+               created_at TEXT NOT NULL,
+               PRIMARY KEY (ticker, horizon),
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+    ]),
+    (11, "Record which forecasting model produced each forecast", [
+        "ALTER TABLE forecasts ADD COLUMN model TEXT NOT NULL DEFAULT 'random_forest'",
+    ]),
+    (12, "Weight the sector rollups' cap-weighted returns by market capitalisation", [
+        rebuild_sector_daily,
+    ]),
+    (13, "Per-ticker price versions", [
+        '''CREATE TABLE IF NOT EXISTS price_versions (
+               ticker TEXT PRIMARY KEY,
+               data_version INTEGER NOT NULL,
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        # Every ticker starts at the current generation
+        '''INSERT OR REPLACE INTO price_versions (ticker, data_version)
+           SELECT DISTINCT ticker, COALESCE((SELECT value FROM metadata WHERE key = 'data_generation'), 0)
+           FROM stock_prices''',
+    ]),
+    (14, "Stamp forecasts with the ticker's price version instead of the global generation", [
+        "ALTER TABLE forecasts RENAME COLUMN generation TO data_version",
+    ]),
+    (15, "Keep one set of forecasts per model", [
+        '''CREATE TABLE forecasts_by_model (
+               ticker TEXT,
+               model TEXT NOT NULL,
+               horizon INTEGER,
+               data_version INTEGER NOT NULL,
+               feature_version INTEGER NOT NULL,
+               predictions TEXT NOT NULL,
+               mae REAL,
+               r_squared REAL,
+               created_at TEXT NOT NULL,
+               PRIMARY KEY (ticker, model, horizon),
+               FOREIGN KEY (ticker) REFERENCES companies(ticker)
+           )''',
+        '''INSERT INTO forecasts_by_model
+               (ticker, model, horizon, data_version, feature_version, predictions, mae, r_squared, created_at)
+           SELECT ticker, model, horizon, data_version, feature_version, predictions, mae, r_squared, created_at
+           FROM forecasts''',
+        "DROP TABLE forecasts",
+        "ALTER TABLE forecasts_by_model RENAME TO forecasts",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Apply every migration newer than the database's version. Returns the list
+# of versions applied.
+def migrate(conn):
+    applied = []
+    current = get_schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.commit()
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append(version)
+        print(f"Applied schema migration {version}: {description}")
+    return applied
+
+
+# The dashboard's real queries, used to check that each one is served by an
+# index. Parameters are placeholders; EXPLAIN QUERY PLAN does not need data.
+DASHBOARD_QUERIES = {
+    'categories': ("SELECT DISTINCT category FROM companies", ()),
+    'companies_by_category': ("SELECT name FROM companies WHERE category = ?", ('x',)),
+    'company_details': ('''SELECT c.ticker, f.pe_ratio, f.market_cap, f.revenue, f.net_income, f.earnings_per_share
+                           FROM companies c
+                           JOIN financials f ON c.ticker = f.ticker AND f.valid_to IS NULL
+                           WHERE c.name = ?
+                           LIMIT 1''', ('x',)),
+    'stock_history': ("SELECT ticker, date, close FROM stock_prices WHERE ticker = ? AND date >= ? AND date <= ? "
+                      "ORDER BY date", ('x', 'x', 'x')),
+    'latest_financials': ('''SELECT market_cap, pe_ratio, revenue, net_income FROM financials
+                             WHERE ticker = ? AND valid_to IS NULL''', ('x',)),
+    'financials_as_of': ('''SELECT market_cap, pe_ratio, revenue, net_income FROM financials
+                            WHERE ticker = ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)''',
+                         ('x', 'x', 'x')),
+    'risk_score': ("SELECT risk_score FROM risk_scores WHERE ticker = ?", ('x',)),
+    'company_category': ("SELECT category FROM companies WHERE ticker = ?", ('x',)),
+    'sector_stats': ('''SELECT s.metric, s.mean, f.market_cap, f.pe_ratio, f.revenue, f.net_income
+                        FROM companies c
+                        JOIN sector_stats s ON s.sector = c.category
+                        JOIN financials f ON f.ticker = c.ticker AND f.valid_to IS NULL
+                        WHERE c.ticker = ?''', ('x',)),
+    'price_version': ("SELECT data_version FROM price_versions WHERE ticker = ?", ('x',)),
+    'sector_daily': ('''SELECT sector, date, cap_weighted_return FROM sector_daily
+                        WHERE date BETWEEN ? AND ? ORDER BY sector, date''', ('x', 'x')),
+    'forecast': ('''SELECT predictions, mae, r_squared, created_at FROM forecasts
+                    WHERE ticker = ? AND horizon = ? AND data_version = ? AND feature_version = ? AND model = ?''',
+                 ('x', 7, 0, 0, 'x')),
+    'data_generation': ("SELECT value FROM metadata WHERE key = ?", ('x',)),
+    'login': ("SELECT * FROM userstable WHERE username = ? AND password = ?", ('x', 'x')),
+}
+
+# Queries that read a whole (small) table by design
+FULL_SCAN_ALLOWED = {
+    'all_companies': ("SELECT name FROM companies", ()),
+    'company_names': ("SELECT ticker, name, category FROM companies", ()),
+    # The screener filters the whole (one row per ticker) table in memory
+    'screener': ("SELECT * FROM screener_metrics", ()),
+    # Built once per data generation (price_cube.py)
+    'price_cube': ("SELECT ticker, date, open, close, high, low, volume FROM stock_prices", ()),
+}
+
+# Run EXPLAIN QUERY PLAN for each query and return {name: [plan details]}
+def explain_queries(conn, queries=None):
+    queries = DASHBOARD_QUERIES if queries is None else queries
+    return {name: [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            for name, (sql, params) in queries.items()}
+
+# A plan step is a full scan if it walks a table without any index
+def is_full_scan(detail):
+    return detail.startswith('SCAN') and 'INDEX' not in detail
+
+# Flag every dashboard query whose plan contains a full table scan.
+# Returns a list of (query name, plan detail).
+def check_query_plans(conn, queries=None):
+    return [(name, detail)
+            for name, details in explain_queries(conn, queries).items()
+            for detail in details if is_full_scan(detail)]
+
+# Command-line entry point: migrate, and optionally check the query plans
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the KLSE database schema and check query plans.")
+    parser.add_argument('--check', action='store_true', help="EXPLAIN the dashboard queries and flag full scans")
+    args = parser.parse_args()
+
+    conn = open_write_connection()
+    try:
+        migrate(conn)
+        print(f"Schema is at version {get_schema_version(conn)}")
+        if args.check:
+            for name, details in explain_queries(conn).items():
+                print(f"{name}:")
+                for detail in details:
+                    print(f"    {'FULL SCAN ' if is_full_scan(detail) else ''}{detail}")
+            flagged = check_query_plans(conn)
+            if flagged:
+                print(f"{len(flagged)} full table scans found.")
+                sys.exit(1)
+            print("No full table scans in the dashboard queries.")
+    finally:
+        conn.close()
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from risk_engine import align_rows, to_age_matrices
+
+# Market-wide screener metrics, one row per ticker, precomputed into the
+# screener_metrics table after each ingestion run (after the risk scores,
+# which it reuses). Like the rollups, refresh_screener_metrics does not commit.
+
+# Trailing returns in trading days
+RETURN_PERIODS = {'return_1m': 21, 'return_3m': 63, 'return_1y': 252}
+
+# Trading days averaged for the volume filter
+AVERAGE_VOLUME_DAYS = 20
+
+# Last year of closes and volumes of every ticker, newest first
+RECENT_PRICES = f'''
+    SELECT ticker, close, volume FROM (
+        SELECT ticker, close, volume, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY date DESC) AS age
+        FROM stock_prices
+    ) WHERE age <= {max(RETURN_PERIODS.values()) + 1}
+    ORDER BY ticker, age
+'''
+
+# Company, current fundamentals and risk score of every company
+COMPANY_METRICS = '''
+    SELECT c.ticker, c.name, c.category AS sector, f.market_cap, f.pe_ratio, r.volatility, r.risk_score
+    FROM companies c
+    LEFT JOIN financials f ON f.ticker = c.ticker AND f.valid_to IS NULL
+    LEFT JOIN risk_scores r ON r.ticker = c.ticker
+    ORDER BY c.ticker
+'''
+
+SCREENER_COLUMNS = ['ticker', 'name', 'sector', 'close', 'market_cap', 'pe_ratio', 'return_1m', 'return_3m',
+                    'return_1y', 'volatility', 'avg_volume', 'risk_score']
+
+# Compute the screener metrics of every company. Returns a DataFrame with
+# SCREENER_COLUMNS; returns are in %.
+def compute_screener_metrics(conn):
+    metrics = pd.read_sql(COMPANY_METRICS, conn)
+    tickers = metrics['ticker'].to_numpy(dtype=str)
+
+    for column in ['close', *RETURN_PERIODS, 'avg_volume']:
+        metrics[column] = np.nan
+
+    price_rows = conn.execute(RECENT_PRICES).fetchall()
+    if price_rows:
+        price_tickers, _, (closes, volumes) = to_age_matrices(price_rows, max(RETURN_PERIODS.values()) + 1)
+        metrics['close'] = align_rows(tickers, price_tickers, closes[:, 0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for column, days in RETURN_PERIODS.items():
+                returns = (closes[:, 0] / closes[:, days] - 1) * 100
+                metrics[column] = align_rows(tickers, price_tickers, np.where(np.isfinite(returns), returns, np.nan))
+        metrics['avg_volume'] = align_rows(tickers, price_tickers, np.nanmean(volumes[:, :AVERAGE_VOLUME_DAYS], axis=1))
+    return metrics[SCREENER_COLUMNS]
+
+# Recompute and replace every row of screener_metrics. Returns the number of
+# tickers.
+def refresh_screener_metrics(conn):
+    metrics = compute_screener_metrics(conn)
+    conn.execute("DELETE FROM screener_metrics")
+    rows = metrics.astype(object).where(metrics.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(f'''INSERT INTO screener_metrics ({', '.join(SCREENER_COLUMNS)})
+                         VALUES ({', '.join('?' * len(SCREENER_COLUMNS))})''', list(rows))
+    return len(metrics)
+
+# Load the whole screener table (860-odd rows) for in-memory filtering
+def load_screener_metrics(conn):
+    return pd.read_sql(f"SELECT {', '.join(SCREENER_COLUMNS)} FROM screener_metrics", conn)
+
+# Filter the metrics with {column: (low, high)} bounds (either may be None
+# for an open end) using one vectorized mask, then sort. A bounded column
+# excludes tickers with no value for it.
+def screen(metrics, bounds, sort_by='market_cap', ascending=False):
+    mask = np.ones(len(metrics), dtype=bool)
+    for column, (low, high) in bounds.items():
+        values = metrics[column].to_numpy(dtype=float)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+    return metrics[mask].sort_values(sort_by, ascending=ascending, na_position='last')